@@ -1,9 +1,13 @@
 # Updated: 2025-09-27 18:30 - Fixed OpenAI model and added Emergent LLM support
-from fastapi import FastAPI, Query, HTTPException, File, UploadFile, Form, Depends
+import time
+_IMPORT_STARTED = time.perf_counter()  # startup benchmark: import time / time-to-first-response
+
+from fastapi import FastAPI, Query, HTTPException, File, UploadFile, Form, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, NamedTuple
 from datetime import datetime, timedelta, date
 import os
 import random
@@ -13,6 +17,19 @@ import unicodedata
 import re
 import uuid
 import base64
+import bisect
+import sqlite3
+import threading
+import asyncio
+import contextlib
+import contextvars
+import functools
+import gzip
+import hashlib
+import struct
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from datetime import datetime, timedelta, timezone
 
 
@@ -37,6 +54,10 @@ GA4_SERVICE_ACCOUNT_JSON = os.environ.get("GA4_SERVICE_ACCOUNT_JSON")  # optiona
 GA4_SERVICE_ACCOUNT_FILE = os.environ.get("GA4_SERVICE_ACCOUNT_FILE")  # optional: path to JSON key file
 GA4_PROJECT_ID = os.environ.get("GA4_PROJECT_ID")  # optional
 GA4_QUOTA_PROJECT_ID = os.environ.get("GA4_QUOTA_PROJECT_ID")  # optional
+# Days younger than this are still being processed by GA4 and are never persisted
+GA4_STORE_LAG_DAYS = int(os.environ.get("GA4_STORE_LAG_DAYS", "3"))
+# Rows per page when filling the day store (GA4 returns at most 250k rows per report)
+GA4_STORE_PAGE_ROWS = int(os.environ.get("GA4_STORE_PAGE_ROWS", "250000"))
 
 ADS_DEVELOPER_TOKEN = os.environ.get("ADS_DEVELOPER_TOKEN")
 ADS_LOGIN_CUSTOMER_ID = os.environ.get("ADS_LOGIN_CUSTOMER_ID")
@@ -44,12 +65,32 @@ ADS_CUSTOMER_ID = os.environ.get("ADS_CUSTOMER_ID")
 ADS_OAUTH_CLIENT_ID = os.environ.get("ADS_OAUTH_CLIENT_ID")
 ADS_OAUTH_CLIENT_SECRET = os.environ.get("ADS_OAUTH_CLIENT_SECRET")
 ADS_OAUTH_REFRESH_TOKEN = os.environ.get("ADS_OAUTH_REFRESH_TOKEN")
+# Days younger than this may still get late conversions/cost adjustments and are always re-fetched
+ADS_STORE_LAG_DAYS = int(os.environ.get("ADS_STORE_LAG_DAYS", "3"))
+ADS_RECENT_TTL_SECONDS = int(os.environ.get("ADS_RECENT_TTL_SECONDS", "300"))
+# Campaign name/status are current values: re-read for every campaign this often
+ADS_CAMPAIGNS_TTL_SECONDS = int(os.environ.get("ADS_CAMPAIGNS_TTL_SECONDS", "600"))
+
+# Max upstream calls in flight per worker (GA4 allows ~10 concurrent requests per property)
+GA4_MAX_CONCURRENCY = int(os.environ.get("GA4_MAX_CONCURRENCY", "4"))
+ADS_MAX_CONCURRENCY = int(os.environ.get("ADS_MAX_CONCURRENCY", "4"))
+# GA4 slots prefetch/background work may hold at once, so user requests always find one free
+GA4_BACKGROUND_MAX_CONCURRENCY = int(os.environ.get("GA4_BACKGROUND_MAX_CONCURRENCY", "1"))
+
+# GA4 quota reserve: below these remaining tokens background GA4 work is deferred
+# (standard properties get 40k tokens/hour, 200k/day and 14k/project/hour)
+GA4_QUOTA_MIN_HOURLY_TOKENS = int(os.environ.get("GA4_QUOTA_MIN_HOURLY_TOKENS", "8000"))
+GA4_QUOTA_MIN_DAILY_TOKENS = int(os.environ.get("GA4_QUOTA_MIN_DAILY_TOKENS", "40000"))
+GA4_QUOTA_MIN_PROJECT_HOURLY_TOKENS = int(os.environ.get("GA4_QUOTA_MIN_PROJECT_HOURLY_TOKENS", "2800"))
 
 # Supabase Configuration
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_ANON_KEY = os.environ.get("SUPABASE_ANON_KEY")
 SUPABASE_SERVICE_KEY = os.environ.get("SUPABASE_SERVICE_KEY")
 
+# Local fact store (SQLite file, no external service)
+FACTS_DB_PATH = os.environ.get("FACTS_DB_PATH") or str(Path(__file__).with_name(".data") / "facts.sqlite")
+
 # JWT Configuration
 JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "your-super-secret-jwt-key-change-in-production")
 JWT_ALGORITHM = "HS256"
@@ -65,25 +106,18 @@ security = HTTPBearer()
 ALLOWED_DOMAINS = ["@ilhafaceira.com.br", "@amandagattiboni.com"]
 ALLOWED_EMAILS = ["alangattiboni@gmail.com"]
 
-# ----- OpenAI (opcional) -----
+# ----- orjson (opcional): serialização rápida das respostas em cache -----
 try:
-    from openai import OpenAI
-except Exception as _e:
-    OpenAI = None
+    import orjson
+except Exception:
+    orjson = None
 
-openai_client = None
+# ----- Brotli (opcional): variante br das respostas em cache; sem ele, só gzip -----
 try:
-    if os.environ.get("OPENAI_API_KEY") and OpenAI:
-        openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-except Exception as e:
-    print("[OPENAI] init failed:", e)
-
-
-
-# -------------------- CLIENT INIT --------------------
+    import brotli
+except Exception:
+    brotli = None
 
-ga4_client = None
-ads_client = None
 
 # -------------------- SUPABASE CLIENT INIT --------------------
 
@@ -109,10 +143,11 @@ def build_supabase_client():
         return None
 
 
-def build_ga4_client():
+def build_ga4_client(use_async: bool = False):
+    """Sync BetaAnalyticsDataClient, or the asyncio variant when use_async=True."""
     try:
         from google.oauth2 import service_account
-        from google.analytics.data_v1beta import BetaAnalyticsDataClient
+        from google.analytics.data_v1beta import BetaAnalyticsDataClient, BetaAnalyticsDataAsyncClient
     except Exception as e:
         print(f"[GA4] google libs not available: {e}")
         return None
@@ -152,6 +187,8 @@ def build_ga4_client():
                 cred = cred.with_quota_project(GA4_QUOTA_PROJECT_ID)
             except Exception as e:
                 print(f"[GA4] with_quota_project failed: {e}")
+        if use_async:
+            return BetaAnalyticsDataAsyncClient(credentials=cred)
         client = BetaAnalyticsDataClient(credentials=cred)
         return client
     except Exception as e:
@@ -185,8 +222,63 @@ def build_ads_client():
         return None
 
 
-ga4_client = build_ga4_client()
-ads_client = build_ads_client()
+def build_openai_client():
+    """OpenAI SDK client (imported here: the package is optional and slow to import)."""
+    if not os.environ.get("OPENAI_API_KEY"):
+        return None
+    try:
+        from openai import OpenAI
+        return OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    except Exception as e:
+        print("[OPENAI] init failed:", e)
+        return None
+
+
+# -------------------- CLIENT INIT --------------------
+# The GA4/Ads/OpenAI SDKs are heavy to import and build gRPC channels, so nothing is
+# created at import time: each client is built on first use (once, under its own lock)
+# or by the optional warm-up task right after startup. A failed init is cached as None,
+# same as before; restart the process after fixing credentials.
+
+INTEGRATION_BUILDERS = {
+    "ga4": build_ga4_client,
+    "ads": build_ads_client,
+    "openai": build_openai_client,
+}
+INTEGRATIONS_WARMUP = os.environ.get("INTEGRATIONS_WARMUP", "1") == "1"
+
+_integrations: Dict[str, Any] = {}
+_integration_locks = {name: threading.Lock() for name in INTEGRATION_BUILDERS}
+integration_init_seconds: Dict[str, float] = {}
+
+
+def get_integration(name: str):
+    """Client for an integration, built on first use; None when not configured."""
+    try:
+        return _integrations[name]
+    except KeyError:
+        pass
+    with _integration_locks[name]:
+        if name not in _integrations:
+            t0 = time.perf_counter()
+            client = INTEGRATION_BUILDERS[name]()
+            integration_init_seconds[name] = round(time.perf_counter() - t0, 3)
+            print(f"[INIT] {name} client {'ready' if client else 'unavailable'} in {integration_init_seconds[name]}s")
+            _integrations[name] = client
+        return _integrations[name]
+
+
+def get_ga4_client():
+    return get_integration("ga4")
+
+
+def get_ads_client():
+    return get_integration("ads")
+
+
+def get_openai_client():
+    return get_integration("openai")
+
 
 # -------------------- APP --------------------
 app = FastAPI(title="Calma Data API", version="1.3.0")
@@ -199,27 +291,1027 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# -------------------- CACHE --------------------
-class SimpleCache:
+# Startup benchmark: import time is taken at the end of this module, time-to-first-response
+# by the middleware below (both measured from the first line of server.py).
+startup_stats: Dict[str, Optional[float]] = {"import_seconds": None, "first_response_seconds": None}
+
+
+class FirstResponseTimer:
+    """Pure ASGI middleware that records when the process sends its first HTTP response."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or startup_stats["first_response_seconds"] is not None:
+            return await self.app(scope, receive, send)
+
+        async def send_timed(message):
+            if message["type"] == "http.response.start" and startup_stats["first_response_seconds"] is None:
+                startup_stats["first_response_seconds"] = round(time.perf_counter() - _IMPORT_STARTED, 3)
+                print(f"[STARTUP] first response after {startup_stats['first_response_seconds']}s "
+                      f"(import {startup_stats['import_seconds']}s)")
+            await send(message)
+
+        await self.app(scope, receive, send_timed)
+
+
+app.add_middleware(FirstResponseTimer)
+
+# -------------------- METRICS --------------------
+# Counters/gauges/histograms kept in process and exposed in the Prometheus text
+# format at /metrics. Each uvicorn/gunicorn worker has its own registry: scrape
+# every worker (or run a single one) to see the whole picture.
+
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_UPSTREAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+METRICS_ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+_metrics_lock = threading.Lock()
+METRICS_REGISTRY: List["Metric"] = []
+
+
+def _metric_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metric:
+    """One metric family; series are keyed by the tuple of label values."""
+
+    def __init__(self, kind: str, name: str, doc: str, labels: Tuple[str, ...] = (),
+                 buckets: Optional[Tuple[float, ...]] = None):
+        self.kind = kind  # counter | gauge | histogram
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self.buckets = buckets
+        # counter/gauge: value; histogram: [per-bucket counts (+Inf last), sum, count]
+        self.series: Dict[Tuple[str, ...], Any] = {}
+        METRICS_REGISTRY.append(self)
+
+    def inc(self, *label_values, amount: float = 1.0):
+        with _metrics_lock:
+            self.series[label_values] = self.series.get(label_values, 0.0) + amount
+
+    def dec(self, *label_values, amount: float = 1.0):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value: float, *label_values):
+        with _metrics_lock:
+            self.series[label_values] = float(value)
+
+    def observe(self, value: float, *label_values):
+        with _metrics_lock:
+            state = self.series.get(label_values)
+            if state is None:
+                state = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _labels(self, values: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{k}="{_metric_label(v)}"' for k, v in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        with _metrics_lock:
+            series = [(k, [list(v[0]), v[1], v[2]] if self.kind == "histogram" else v)
+                      for k, v in self.series.items()]
+        for values, state in sorted(series):
+            if self.kind != "histogram":
+                lines.append(f"{self.name}{self._labels(values)} {state:g}")
+                continue
+            counts, total, n = state
+            running = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                running += c
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{self._labels(values, le)} {running}")
+            lines.append(f"{self.name}_sum{self._labels(values)} {total:g}")
+            lines.append(f"{self.name}_count{self._labels(values)} {n}")
+        return lines
+
+
+def render_metrics() -> str:
+    return "\n".join(line for m in METRICS_REGISTRY for line in m.render()) + "\n"
+
+
+http_requests_total = Metric("counter", "calma_http_requests_total",
+                             "HTTP requests by route template, method and status.", ("route", "method", "status"))
+http_request_seconds = Metric("histogram", "calma_http_request_duration_seconds",
+                              "HTTP request latency by route template.", ("route", "method"), METRICS_LATENCY_BUCKETS)
+http_in_flight = Metric("gauge", "calma_http_requests_in_flight", "HTTP requests currently being served.")
+cache_hits_total = Metric("counter", "calma_cache_hits_total",
+                          "Cache hits by key prefix (state=fresh|stale).", ("prefix", "state"))
+cache_misses_total = Metric("counter", "calma_cache_misses_total",
+                            "Cache misses by key prefix (reason=miss|refresh).", ("prefix", "reason"))
+cache_evictions_total = Metric("counter", "calma_cache_evictions_total", "LRU evictions by key prefix.", ("prefix",))
+upstream_seconds = Metric("histogram", "calma_upstream_call_duration_seconds",
+                          "GA4/Ads helper latency (local store reads included).", ("upstream", "helper"),
+                          METRICS_UPSTREAM_BUCKETS)
+upstream_in_flight = Metric("gauge", "calma_upstream_calls_in_flight",
+                            "GA4/Ads helpers and LLM calls currently running.", ("upstream",))
+ga4_report_seconds = Metric("histogram", "calma_ga4_run_report_duration_seconds",
+                            "GA4 Data API RPC latency.", ("method",), METRICS_UPSTREAM_BUCKETS)
+ga4_report_rows = Metric("histogram", "calma_ga4_run_report_rows", "Rows returned per GA4 report.",
+                         ("method",), METRICS_ROW_BUCKETS)
+ads_gaql_seconds = Metric("histogram", "calma_ads_gaql_duration_seconds",
+                          "Google Ads GAQL search_stream latency, until the stream is drained.", ("helper",),
+                          METRICS_UPSTREAM_BUCKETS)
+ads_gaql_rows = Metric("histogram", "calma_ads_gaql_rows", "Rows streamed per GAQL query.", ("helper",),
+                       METRICS_ROW_BUCKETS)
+ga4_quota_remaining = Metric("gauge", "calma_ga4_quota_remaining",
+                             "Remaining GA4 property quota from the last report (window=tokens_per_hour...).",
+                             ("window",))
+llm_seconds = Metric("histogram", "calma_llm_call_duration_seconds", "LLM call latency.",
+                     ("provider", "mode", "outcome"), METRICS_UPSTREAM_BUCKETS)
+
+
+@contextlib.contextmanager
+def llm_timer(provider: str, mode: str):
+    """Times one LLM call (a whole stream for mode="stream"), labelled ok/error."""
+    upstream_in_flight.inc("llm")
+    t0 = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        upstream_in_flight.dec("llm")
+        llm_seconds.observe(time.perf_counter() - t0, provider, mode, outcome)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware: in-flight gauge plus latency/status per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = [500]
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        http_in_flight.inc()
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            http_in_flight.dec()
+            # the router stores the matched route in the scope; unknown paths share one series
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_request_seconds.observe(time.perf_counter() - t0, route, scope["method"])
+            http_requests_total.inc(route, scope["method"], str(status[0]))
+
+
+app.add_middleware(MetricsMiddleware)
+
+# -------------------- EXECUTORS --------------------
+# Blocking SDK calls (LLM, Supabase, Resend...) run in bounded thread pools, one per
+# dependency, so a slow call never stalls the event loop of the uvicorn worker.
+# Sizes are overridable with EXECUTOR_<NAME>_WORKERS (e.g. EXECUTOR_LLM_WORKERS=2).
+EXECUTOR_DEFAULT_WORKERS: Dict[str, int] = {
+    "llm": 4,
+    "supabase": 8,
+    "email": 2,
+    "auth": 2,  # bcrypt hashing/verification
+    "ga4": 8,
+    "ads": 8,
+    "compress": 2,  # gzip/brotli variants of cached bodies
+    "cache": 2,  # shared (SQLite) cache tier reads/writes
+}
+
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name: str) -> ThreadPoolExecutor:
+    with _executors_lock:
+        pool = _executors.get(name)
+        if pool is None:
+            default = EXECUTOR_DEFAULT_WORKERS.get(name, 4)
+            workers = int(os.environ.get(f"EXECUTOR_{name.upper()}_WORKERS", default))
+            pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=f"calma-{name}")
+            _executors[name] = pool
+        return pool
+
+
+async def run_blocking(pool: str, fn, *args, **kwargs):
+    """Await a blocking call executed in the named pool (context vars are propagated)."""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(pool), functools.partial(ctx.run, fn, *args, **kwargs))
+
+
+@app.on_event("shutdown")
+def shutdown_executors():
+    with _executors_lock:
+        for pool in _executors.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        _executors.clear()
+
+# -------------------- ASYNC INTEGRATIONS (GA4/ADS) --------------------
+# Per-service semaphores cap how many upstream calls a worker keeps in flight.
+# Raw GA4 reports go through the native asyncio client; store-backed helpers and
+# the (sync-only) Google Ads SDK run in their executor pools.
+ga4_semaphore = asyncio.Semaphore(max(1, GA4_MAX_CONCURRENCY))
+# at least one slot always stays free for user requests; with a single slot there is no background GA4 work
+GA4_BACKGROUND_SLOTS = max(0, min(GA4_BACKGROUND_MAX_CONCURRENCY, GA4_MAX_CONCURRENCY - 1))
+ga4_background_semaphore = asyncio.Semaphore(GA4_BACKGROUND_SLOTS)
+ads_semaphore = asyncio.Semaphore(max(1, ADS_MAX_CONCURRENCY))
+
+# "interactive" for user requests, "background" for prefetch work (propagated into executor threads)
+request_priority: contextvars.ContextVar[str] = contextvars.ContextVar("request_priority", default="interactive")
+
+
+class FillPriority:
+    """Priority of a shared (single-flight) cache fill; promoted when an interactive caller joins it."""
+
+    def __init__(self, priority: str):
+        self.priority = priority
+        self.promoted = asyncio.Event()
+
+    def promote(self):
+        self.priority = "interactive"
+        self.promoted.set()
+
+
+# set inside each cache fill task; overrides request_priority for the work it runs
+fill_priority: contextvars.ContextVar[Optional[FillPriority]] = contextvars.ContextVar("fill_priority", default=None)
+
+
+def current_priority() -> str:
+    handle = fill_priority.get()
+    return handle.priority if handle is not None else request_priority.get()
+
+
+async def _ga4_background_acquire() -> bool:
+    """
+    Takes a background GA4 slot. A fill promoted while queued stops waiting and
+    runs as interactive instead (False: no background slot held).
+    """
+    handle = fill_priority.get()
+    if handle is None:
+        await ga4_background_semaphore.acquire()
+        return True
+    acquire = asyncio.ensure_future(ga4_background_semaphore.acquire())
+    promoted = asyncio.ensure_future(handle.promoted.wait())
+    try:
+        await asyncio.wait((acquire, promoted), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        promoted.cancel()
+        if not acquire.done():
+            acquire.cancel()  # Semaphore.acquire hands the slot back if it was just granted
+    return acquire.done() and not acquire.cancelled()
+
+
+@contextlib.asynccontextmanager
+async def ga4_slot():
+    """A GA4 concurrency slot; background work is capped to GA4_BACKGROUND_SLOTS of them."""
+    # with no background slots prefetch_deferred() keeps such work away; never block on an empty semaphore
+    background = bool(GA4_BACKGROUND_SLOTS) and current_priority() == "background" and await _ga4_background_acquire()
+    try:
+        async with ga4_semaphore:
+            yield
+    finally:
+        if background:
+            ga4_background_semaphore.release()
+
+
+class GA4QuotaTracker:
+    """
+    Last PropertyQuota returned by GA4 (every report sets return_property_quota).
+    Hourly readings count for an hour; daily ones until GA4's day (Pacific time) rolls over.
+    """
+    WINDOWS = ("tokens_per_hour", "tokens_per_day", "tokens_per_project_per_hour", "concurrent_requests",
+               "server_errors_per_project_per_hour", "potentially_thresholded_requests_per_hour")
+
     def __init__(self):
-        self.store: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+        self.state: Dict[str, Dict[str, int]] = {}
+        self.updated_at: Optional[float] = None
+        self.day: Optional[str] = None
+
+    @staticmethod
+    def _pacific_day() -> str:
+        from zoneinfo import ZoneInfo
+        return datetime.now(ZoneInfo("America/Los_Angeles")).strftime("%Y-%m-%d")
+
+    def record(self, resp):
+        if "property_quota" not in resp:
+            return
+        quota = resp.property_quota
+        state = {w: {"consumed": getattr(quota, w).consumed, "remaining": getattr(quota, w).remaining}
+                 for w in self.WINDOWS}
+        with self.lock:
+            self.state = state
+            self.updated_at = time.time()
+            self.day = self._pacific_day()
+        for w in self.WINDOWS:
+            ga4_quota_remaining.set(state[w]["remaining"], w)
+
+    def remaining(self) -> Dict[str, Optional[int]]:
+        """Remaining tokens per window; None when unknown or the reading is too old."""
+        with self.lock:
+            state, updated_at, day = self.state, self.updated_at, self.day
+        if updated_at is None:
+            return {w: None for w in self.WINDOWS}
+        hour_ok = time.time() - updated_at < 3600
+        day_ok = day == self._pacific_day()
+        return {w: state[w]["remaining"] if (day_ok if w == "tokens_per_day" else hour_ok) else None
+                for w in self.WINDOWS}
+
+    def low(self) -> bool:
+        """True when any token window is under its reserve (unknown counts as fine)."""
+        left = self.remaining()
+        floors = {
+            "tokens_per_hour": GA4_QUOTA_MIN_HOURLY_TOKENS,
+            "tokens_per_day": GA4_QUOTA_MIN_DAILY_TOKENS,
+            "tokens_per_project_per_hour": GA4_QUOTA_MIN_PROJECT_HOURLY_TOKENS,
+        }
+        return any(left[w] is not None and left[w] < floor for w, floor in floors.items())
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "remaining": self.remaining(),
+            "low": self.low(),
+            "updated_at": datetime.utcfromtimestamp(self.updated_at).isoformat() + "Z" if self.updated_at else None,
+        }
+
+
+ga4_quota = GA4QuotaTracker()
+
+_ga4_async_client = None
+_ga4_async_lock = threading.Lock()
+
+
+def get_ga4_async_client():
+    """BetaAnalyticsDataAsyncClient built on first use (False once init has failed).
+
+    Call it from the event loop thread: grpc.aio binds the channel to the running loop.
+    """
+    global _ga4_async_client
+    with _ga4_async_lock:
+        if _ga4_async_client is None:
+            _ga4_async_client = (build_ga4_client(use_async=True) if get_ga4_client() else None) or False
+        return _ga4_async_client
+
+
+async def warm_up_integrations():
+    """Build the integration clients ahead of the first requests that need them.
+
+    The sync clients are built in the executors. The grpc.aio client must be created
+    on the loop thread (a pool thread has no event loop), once the sync GA4 client
+    (and its credentials) exists, so building it never blocks the loop for long.
+    """
+    jobs = [
+        run_blocking("ga4", get_ga4_client),
+        run_blocking("ads", get_ads_client),
+        run_blocking("llm", get_openai_client),
+    ]
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*jobs, return_exceptions=True)
+    try:
+        get_ga4_async_client()
+    except Exception as e:
+        results.append(e)
+    for r in results:
+        if isinstance(r, Exception):
+            print(f"[INIT] warm-up failed: {r}")
+    print(f"[INIT] integrations warmed up in {time.perf_counter() - t0:.3f}s")
+
+
+@app.on_event("startup")
+async def start_integrations_warmup():
+    if INTEGRATIONS_WARMUP:
+        # Fire-and-forget: startup (and the first /api/health) never waits on SDK init.
+        asyncio.create_task(warm_up_integrations())
+
+
+def ga4_observe(method: str, t0: float, resp):
+    """Latency/row metrics and the quota reading of a GA4 response (or batch)."""
+    ga4_report_seconds.observe(time.perf_counter() - t0, method)
+    reports = getattr(resp, "reports", None) or [resp]
+    for report in reports:
+        ga4_report_rows.observe(len(report.rows), method)
+    ga4_quota.record(reports[-1])
+
+
+def ga4_run_report(req):
+    """Blocking run_report on the sync GA4 client, with latency/row/quota tracking."""
+    req.return_property_quota = True
+    t0 = time.perf_counter()
+    resp = get_ga4_client().run_report(req)
+    ga4_observe("run_report", t0, resp)
+    return resp
+
+
+async def ga4_run_report_async(req):
+    if "ga4" not in _integrations:
+        await run_blocking("ga4", get_ga4_client)  # credentials/sync client off the loop
+    async with ga4_slot():
+        client = get_ga4_async_client()
+        if not client:
+            return await run_blocking("ga4", ga4_run_report, req)
+        req.return_property_quota = True
+        t0 = time.perf_counter()
+        resp = await client.run_report(request=req)
+        ga4_observe("run_report", t0, resp)
+        return resp
+
+
+async def upstream_call(upstream: str, slot, fn, *args, **kwargs):
+    """Run `fn` in the upstream's pool while holding `slot`, timed per helper."""
+    async with slot:
+        upstream_in_flight.inc(upstream)
+        t0 = time.perf_counter()
+        try:
+            return await run_blocking(upstream, fn, *args, **kwargs)
+        finally:
+            upstream_in_flight.dec(upstream)
+            upstream_seconds.observe(time.perf_counter() - t0, upstream, fn.__name__)
+
+
+async def ga4_call(fn, *args, **kwargs):
+    """Run a (store-backed) GA4 helper off the event loop under the GA4 limit."""
+    return await upstream_call("ga4", ga4_slot(), fn, *args, **kwargs)
+
+
+async def ads_call(fn, *args, **kwargs):
+    """Run a Google Ads helper off the event loop under the Ads limit."""
+    return await upstream_call("ads", ads_semaphore, fn, *args, **kwargs)
+
+# -------------------- CACHE --------------------
+# Bounded LRU + TTL cache. Entries carry their own TTL and a size estimate;
+# the least recently used ones are evicted once CACHE_MAX_ENTRIES or
+# CACHE_MAX_BYTES is exceeded, and a periodic sweep drops expired entries even
+# if nobody reads them again.
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "512"))
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_DEFAULT_TTL_SECONDS = int(os.environ.get("CACHE_DEFAULT_TTL_SECONDS", "900"))
+CACHE_SWEEP_SECONDS = int(os.environ.get("CACHE_SWEEP_SECONDS", "60"))
+# Values computed from a fallback (GA4/Ads failed → mock/empty payload) live this long, in L1 only
+CACHE_FALLBACK_TTL_SECONDS = int(os.environ.get("CACHE_FALLBACK_TTL_SECONDS", "60"))
+
+# Reasons noted by the compute function currently filling a key (see note_fallback)
+_fill_fallbacks: contextvars.ContextVar[Optional[List[str]]] = contextvars.ContextVar("fill_fallbacks", default=None)
+
+
+def note_fallback(reason: str):
+    """Called by compute functions when they substitute a mock/empty payload for a failed upstream."""
+    marks = _fill_fallbacks.get()
+    if marks is not None:
+        marks.append(reason)
+
+
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get("COMPRESS_BROTLI_QUALITY", "8"))
+
+
+class CachedBody(NamedTuple):
+    """
+    Serialized response body, its strong ETag (content hash) and the gzip/brotli
+    variants, all computed once when the entry is filled.
+    """
+    body: bytes
+    etag: str
+    gzip: Optional[bytes] = None
+    br: Optional[bytes] = None
+
+    @classmethod
+    def of(cls, body: bytes, gz: Optional[bytes] = None, br: Optional[bytes] = None) -> "CachedBody":
+        return cls(body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"', gz, br)
+
+    @classmethod
+    def compressed(cls, body: bytes) -> "CachedBody":
+        """Build with compressed variants (blocking; small bodies are left as is)."""
+        if len(body) < COMPRESS_MIN_BYTES:
+            return cls.of(body)
+        gz = gzip.compress(body, COMPRESS_GZIP_LEVEL)
+        br = brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY) if brotli is not None else None
+        return cls.of(body, gz, br)
+
+    def variant(self, encoding: str) -> Tuple[bytes, str]:
+        """(payload, ETag) of the identity/gzip/br representation; each gets its own strong ETag."""
+        if encoding == "gzip" and self.gzip is not None:
+            return self.gzip, self.etag[:-1] + '-gz"'
+        if encoding == "br" and self.br is not None:
+            return self.br, self.etag[:-1] + '-br"'
+        return self.body, self.etag
+
+    # shared tier format: b"CB2" + three big-endian lengths + body/gzip/br
+    _MAGIC = b"CB2"
+
+    def pack(self) -> bytes:
+        gz, br = self.gzip or b"", self.br or b""
+        return self._MAGIC + struct.pack(">III", len(self.body), len(gz), len(br)) + self.body + gz + br
+
+    @classmethod
+    def unpack(cls, blob: bytes) -> "CachedBody":
+        if not blob.startswith(cls._MAGIC):  # plain body (older entries)
+            return cls.of(blob)
+        n_body, n_gz, n_br = struct.unpack_from(">III", blob, 3)
+        body = blob[15:15 + n_body]
+        gz = blob[15 + n_body:15 + n_body + n_gz] or None
+        br = blob[15 + n_body + n_gz:15 + n_body + n_gz + n_br] or None
+        return cls.of(body, gz, br)
+
+
+def estimate_size(val: Any) -> int:
+    """Approximate footprint of a cached payload (its compact JSON length)."""
+    if isinstance(val, CachedBody):
+        return len(val.body) + len(val.gzip or b"") + len(val.br or b"")
+    try:
+        return len(json.dumps(val, default=str, separators=(",", ":")))
+    except Exception:
+        return 1024
+
+
+class SharedCacheTier:
+    """
+    Cross-process cache tier on a local SQLite file in WAL mode: uvicorn/gunicorn
+    workers on the same box share entries without any external service.
+    Values are stored as JSON (pre-serialized bodies as raw bytes); every failure
+    degrades to a miss. All methods block (busy timeout up to 1s): BoundedCache only
+    calls them from the "cache" executor, never on the event loop.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()  # one connection per thread
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=1.0, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries (key TEXT PRIMARY KEY, val TEXT NOT NULL, ts REAL NOT NULL, ttl REAL NOT NULL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_leases (name TEXT PRIMARY KEY, until REAL NOT NULL)")
+            conn.commit()
+            self.local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Tuple[Any, float, float]]:
+        """(value, ts, ttl) of a live shared entry."""
+        try:
+            row = self._conn().execute("SELECT val, ts, ttl FROM cache_entries WHERE key = ?", (key,)).fetchone()
+        except Exception as e:
+            print(f"[CACHE] shared get failed: {e}")
+            return None
+        if not row or datetime.utcnow().timestamp() - row[1] > row[2]:
+            return None
+        val = CachedBody.unpack(row[0]) if isinstance(row[0], bytes) else json.loads(row[0])
+        return val, row[1], row[2]
+
+    def set(self, key: str, val: Any, ts: float, ttl: float):
+        try:
+            conn = self._conn()
+            # writes run in a pool and may land out of order: never replace a newer entry
+            conn.execute(
+                "INSERT INTO cache_entries (key, val, ts, ttl) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET val = excluded.val, ts = excluded.ts, ttl = excluded.ttl "
+                "WHERE excluded.ts >= cache_entries.ts",
+                (key, val.pack() if isinstance(val, CachedBody) else json.dumps(val, default=str, ensure_ascii=False), ts, ttl),
+            )
+            conn.commit()
+        except Exception as e:
+            print(f"[CACHE] shared set failed: {e}")
+
+    def claim(self, name: str, seconds: float) -> bool:
+        """Take a cross-worker lease on `name` for `seconds`; False while another worker holds it."""
+        now = datetime.utcnow().timestamp()
+        try:
+            conn = self._conn()
+            cur = conn.execute(
+                "INSERT INTO cache_leases (name, until) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET until = excluded.until WHERE cache_leases.until < ?",
+                (name, now + seconds, now),
+            )
+            conn.commit()
+            return cur.rowcount > 0
+        except Exception as e:
+            print(f"[CACHE] shared claim failed: {e}")
+            return True  # degrade to per-worker behaviour
+
+    def sweep(self):
+        try:
+            conn = self._conn()
+            now = datetime.utcnow().timestamp()
+            conn.execute("DELETE FROM cache_entries WHERE ts + ttl < ?", (now,))
+            conn.execute("DELETE FROM cache_leases WHERE until < ?", (now,))
+            conn.commit()
+        except Exception as e:
+            print(f"[CACHE] shared sweep failed: {e}")
+
+
+def cache_key_prefix(key: str) -> str:
+    """Endpoint part of a cache key ("ads-campaigns-enabled-2025-01-01-..." -> "ads-campaigns")."""
+    for name in sorted(ENDPOINT_CACHE_POLICIES, key=len, reverse=True):
+        if key.startswith(name + "-"):
+            return name
+    return "other"
+
+
+class BoundedCache:
+    """
+    In-process L1; when `shared` is given it is consulted on L1 misses and written through on set.
+    Shared-tier I/O runs in the "cache" executor: reads are awaited (entry/get_or_compute),
+    writes are fire-and-forget, so SQLite contention never stalls the event loop.
+    The sync accessors (get, sizes, stats) only look at L1.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES,
+                 shared: Optional[SharedCacheTier] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.shared = shared
+        # key -> {"val", "ts", "ttl", "size"}; order = least recently used first
+        self.store: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.bytes = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+        # key -> task computing it; concurrent misses await the same task
+        self.inflight: Dict[str, asyncio.Task] = {}
+        self.inflight_priority: Dict[str, FillPriority] = {}
 
     def _now(self) -> float:
         return datetime.utcnow().timestamp()
 
-    def get(self, key: str, ttl_seconds: int) -> Optional[Any]:
-        record = self.store.get(key)
+    def _drop(self, key: str):
+        record = self.store.pop(key, None)
+        if record:
+            self.bytes -= record["size"]
+
+    def _put(self, key: str, val: Any, ts: float, ttl: float):
+        size = estimate_size(val)
+        with self.lock:
+            self._drop(key)
+            if size > self.max_bytes:
+                return
+            self.store[key] = {"val": val, "ts": ts, "ttl": ttl, "size": size}
+            self.bytes += size
+            while self.store and (len(self.store) > self.max_entries or self.bytes > self.max_bytes):
+                victim = next(iter(self.store))
+                self._drop(victim)
+                self.evictions += 1
+                cache_evictions_total.inc(cache_key_prefix(victim))
+
+    def _local(self, key: str) -> Optional[Dict[str, Any]]:
+        """Live record from L1."""
+        with self.lock:
+            record = self.store.get(key)
+            if record and self._now() - record["ts"] > record["ttl"]:
+                self._drop(key)
+                record = None
+            if record:
+                self.store.move_to_end(key)
+            return record
+
+    async def _shared_get(self, key: str) -> Optional[Tuple[Any, float, float]]:
+        """(value, ts, ttl) from the shared tier, promoted into L1."""
+        if self.shared is None:
+            return None
+        hit = await run_blocking("cache", self.shared.get, key)
+        if hit is not None:
+            # keep the original timestamp so soft/hard TTLs stay consistent across workers
+            self._put(key, *hit)
+        return hit
+
+    async def _record(self, key: str) -> Optional[Dict[str, Any]]:
+        """Live record from L1, promoting it from the shared tier on an L1 miss."""
+        record = self._local(key)
+        if record:
+            return record
+        hit = await self._shared_get(key)
+        if hit is None:
+            return None
+        val, ts, ttl = hit
+        return {"val": val, "ts": ts, "ttl": ttl}
+
+    def get(self, key: str, ttl_seconds: Optional[int] = None) -> Optional[Any]:
+        record = self._local(key)
         if not record:
             return None
-        if self._now() - record["ts"] > ttl_seconds:
-            del self.store[key]
+        if ttl_seconds is not None and self._now() - record["ts"] > ttl_seconds:
             return None
         return record["val"]
 
-    def set(self, key: str, val: Any):
-        self.store[key] = {"val": val, "ts": self._now()}
+    def set(self, key: str, val: Any, ttl_seconds: Optional[int] = None):
+        ttl = CACHE_DEFAULT_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        ts = self._now()
+        self._put(key, val, ts, ttl)
+        if self.shared is not None:
+            # write-through in the background; SharedCacheTier.set logs its own failures
+            get_executor("cache").submit(self.shared.set, key, val, ts, ttl)
+
+    def sweep(self) -> int:
+        """Drop every expired entry; returns how many were removed."""
+        now = self._now()
+        with self.lock:
+            expired = [k for k, r in self.store.items() if now - r["ts"] > r["ttl"]]
+            for k in expired:
+                self._drop(k)
+        if self.shared is not None:
+            self.shared.sweep()
+        return len(expired)
+
+    def sizes(self) -> Dict[str, int]:
+        """Estimated bytes per key."""
+        with self.lock:
+            return {k: r["size"] for k, r in self.store.items()}
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "entries": len(self.store),
+                "bytes": self.bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "inflight": len(self.inflight),
+                "shared": self.shared.path if self.shared else None,
+            }
+
+    async def freshest(self, key: str, max_age: float) -> Optional[Tuple[Any, float]]:
+        """Like entry(), but an L1 copy older than `max_age` is checked against the shared tier,
+        where another worker may already have refreshed it."""
+        hit = self._local(key)
+        if hit is not None:
+            hit = (hit["val"], self._now() - hit["ts"])
+            if hit[1] <= max_age:
+                return hit
+        if self.shared is None:
+            return hit
+        newer = await run_blocking("cache", self.shared.get, key)
+        if newer is not None and (hit is None or self._now() - newer[1] < hit[1]):
+            self._put(key, *newer)
+            return newer[0], self._now() - newer[1]
+        return hit
+
+    async def claim(self, name: str, seconds: float) -> bool:
+        """Cross-worker lease via the shared tier; always granted without one."""
+        if self.shared is None:
+            return True
+        return await run_blocking("cache", self.shared.claim, name, seconds)
+
+    async def entry(self, key: str) -> Optional[Tuple[Any, float]]:
+        """(value, age in seconds) of a live entry, without TTL checks beyond its own."""
+        record = await self._record(key)
+        if not record:
+            return None
+        return record["val"], self._now() - record["ts"]
+
+    async def get_or_compute(self, key: str, policy: "CachePolicy", compute, refresh: bool = False) -> Any:
+        """
+        Stale-while-revalidate lookup. Younger than policy.soft_ttl: served as is.
+        Between soft and hard TTL: the stale value is served immediately and one
+        background refresh is scheduled. Missing/expired (or refresh=1): computed now.
+        Concurrent computations for a key -- including refresh=1 storms -- share a
+        single task, so a disconnecting caller doesn't cancel it either.
+        """
+        prefix = cache_key_prefix(key)
+        if not refresh:
+            hit = await self.freshest(key, policy.soft_ttl)
+            if hit is not None and hit[0]:
+                val, age = hit
+                if age > policy.soft_ttl:
+                    cache_hits_total.inc(prefix, "stale")
+                    self._start_fill(key, policy, compute)
+                else:
+                    cache_hits_total.inc(prefix, "fresh")
+                return val
+        cache_misses_total.inc(prefix, "refresh" if refresh else "miss")
+        task = self._start_fill(key, policy, compute)
+        if current_priority() == "interactive":
+            # a user is waiting on it now: a fill started by the prefetcher stops queueing for background slots
+            self.inflight_priority[key].promote()
+        return await asyncio.shield(task)
+
+    def _start_fill(self, key: str, policy: "CachePolicy", compute) -> asyncio.Task:
+        task = self.inflight.get(key)
+        if task is None:
+            priority = FillPriority(current_priority())
+            task = asyncio.ensure_future(self._fill(key, policy, compute, priority))
+            self.inflight[key] = task
+            self.inflight_priority[key] = priority
+            task.add_done_callback(lambda t, k=key: self._fill_done(k, t))
+        return task
+
+    def _fill_done(self, key: str, task: asyncio.Task):
+        if self.inflight.get(key) is task:
+            self.inflight.pop(key, None)
+            self.inflight_priority.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[CACHE] refresh of {key} failed: {task.exception()}")
+
+    async def _fill(self, key: str, policy: "CachePolicy", compute, priority: FillPriority) -> Any:
+        marks: List[str] = []
+        _fill_fallbacks.set(marks)  # this task's own context; compute (and its threads) inherit it
+        fill_priority.set(priority)
+        val = await compute()
+        if marks:
+            # Stand-in data: never let it replace a real (even stale) value or reach the
+            # shared tier, and retry upstream after CACHE_FALLBACK_TTL_SECONDS.
+            previous = await self.entry(key)
+            print(f"[CACHE] {key} computed from fallback ({', '.join(marks)})")
+            if previous is not None and previous[0]:
+                return previous[0]
+            self._put(key, val, self._now(), CACHE_FALLBACK_TTL_SECONDS)
+            return val
+        # kept until the hard TTL; past the soft TTL it is only served while refreshing
+        self.set(key, val, policy.hard_ttl)
+        return val
+
+
+class CachePolicy(NamedTuple):
+    soft_ttl: int  # fresh: served without touching upstream
+    hard_ttl: int  # stale but servable (refreshed in background) until here
+
+
+# Stale window added on top of each endpoint's fresh TTL
+CACHE_STALE_SECONDS = int(os.environ.get("CACHE_STALE_SECONDS", str(6 * 3600)))
+
+
+def swr_policy(fresh_seconds: int) -> CachePolicy:
+    return CachePolicy(soft_ttl=fresh_seconds, hard_ttl=fresh_seconds + CACHE_STALE_SECONDS)
+
+
+# Optional L2 shared by all workers on this box (CACHE_SHARED_PATH=path/to/cache.sqlite)
+CACHE_SHARED_PATH = os.environ.get("CACHE_SHARED_PATH")
+cache = BoundedCache(shared=SharedCacheTier(CACHE_SHARED_PATH) if CACHE_SHARED_PATH else None)
+_cache_sweeper: Optional[asyncio.Task] = None
+
+
+async def _sweep_cache_forever():
+    while True:
+        await asyncio.sleep(CACHE_SWEEP_SECONDS)
+        try:
+            await run_blocking("cache", cache.sweep)
+        except Exception as e:
+            print(f"[CACHE] sweep failed: {e}")
+
+
+@app.on_event("startup")
+async def start_cache_sweeper():
+    global _cache_sweeper
+    _cache_sweeper = asyncio.create_task(_sweep_cache_forever())
+
+
+@app.on_event("shutdown")
+async def stop_cache_sweeper():
+    if _cache_sweeper:
+        _cache_sweeper.cancel()
 
-cache = SimpleCache()
+
+# Endpoint payloads are validated against their response_model and serialized once,
+# when the cache is filled; hits hand the stored bytes straight to the client. Every
+# body carries a strong ETag, so revalidations with If-None-Match get a bodiless 304,
+# and its gzip/brotli variants are picked by Accept-Encoding without recompressing.
+def dump_json(payload: Any, model: Optional[type] = None) -> bytes:
+    if model is not None:
+        payload = model.model_validate(payload).model_dump(mode="json", by_alias=True)
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def etag_matches(if_none_match: Optional[str], entry: CachedBody) -> bool:
+    """If-None-Match against any representation of the entry (they share the same content)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    base = entry.etag[:-1]
+    # weak comparison, as If-None-Match requires
+    for tag in if_none_match.split(","):
+        tag = tag.strip().removeprefix("W/")
+        if tag == entry.etag or tag in (base + '-gz"', base + '-br"'):
+            return True
+    return False
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> set:
+    """Content codings of an Accept-Encoding header, minus the ones refused with q=0."""
+    accepted = set()
+    if not accept_encoding:
+        return accepted
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def pick_encoding(accept_encoding: Optional[str], entry: CachedBody) -> str:
+    """Best stored representation the client accepts: br, then gzip, else identity."""
+    accepted = accepted_encodings(accept_encoding)
+    if entry.br is not None and ("br" in accepted or "*" in accepted):
+        return "br"
+    if entry.gzip is not None and ("gzip" in accepted or "*" in accepted):
+        return "gzip"
+    return "identity"
+
+
+async def cached_response(key: str, policy: "CachePolicy", compute, model: Optional[type] = None,
+                          refresh: bool = False, request: Optional[Request] = None) -> Response:
+    """cache.get_or_compute for JSON endpoints: the pre-serialized body as a raw (or 304) response."""
+    async def fill() -> CachedBody:
+        body = dump_json(await compute(), model)
+        return await run_blocking("compress", CachedBody.compressed, body)
+
+    entry = await cache.get_or_compute(key, policy, fill, refresh=refresh)
+    if not isinstance(entry, CachedBody):  # entry written before bodies were pre-serialized
+        entry = CachedBody.of(dump_json(entry, model))
+    encoding = "identity"
+    if request is not None:
+        encoding = pick_encoding(request.headers.get("accept-encoding"), entry)
+    payload, etag = entry.variant(encoding)
+    # no-cache: browsers keep the body but revalidate every time (→ 304 while unchanged)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if request is not None and etag_matches(request.headers.get("if-none-match"), entry):
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=payload, media_type="application/json", headers=headers)
+
+
+# -------------------- CACHE POLICY --------------------
+# TTLs depend on whether a range can still change. A range is "settled" once its last
+# day is past the processing-lag watermark of every source it reads (GA4_STORE_LAG_DAYS /
+# ADS_STORE_LAG_DAYS); settled ranges are cached for days, "moving" ones (today, the
+# last few days) keep short TTLs. Both are configurable per endpoint:
+#   CACHE_TTL_<ENDPOINT>=seconds          (moving, e.g. CACHE_TTL_ADS_CAMPAIGNS=600)
+#   CACHE_SETTLED_TTL_<ENDPOINT>=seconds  (settled)
+CACHE_SETTLED_TTL_SECONDS = int(os.environ.get("CACHE_SETTLED_TTL_SECONDS", str(7 * 24 * 3600)))
+
+
+class EndpointCachePolicy(NamedTuple):
+    sources: Tuple[str, ...]  # "ga4"/"ads" whose lag decides when a range settles; () = never settles
+    moving_ttl: int
+    settled_ttl: int
+
+
+def endpoint_policy(name: str, sources: Tuple[str, ...], moving: int, settled: int = CACHE_SETTLED_TTL_SECONDS) -> EndpointCachePolicy:
+    env_name = name.upper().replace("-", "_")
+    return EndpointCachePolicy(
+        sources=sources,
+        moving_ttl=int(os.environ.get(f"CACHE_TTL_{env_name}", str(moving))),
+        settled_ttl=int(os.environ.get(f"CACHE_SETTLED_TTL_{env_name}", str(settled))),
+    )
+
+
+ENDPOINT_CACHE_POLICIES: Dict[str, EndpointCachePolicy] = {
+    "kpis": endpoint_policy("kpis", ("ga4", "ads"), int(os.environ.get("GA4_CACHE_TTL_SECONDS", "900"))),
+    "acq": endpoint_policy("acq", ("ga4",), 15 * 60),
+    "revuh": endpoint_policy("revuh", ("ga4",), 15 * 60),
+    "salesuh": endpoint_policy("salesuh", (), 15 * 60),  # mock
+    "heatmap": endpoint_policy("heatmap", (), 15 * 60),  # mock
+    "table": endpoint_policy("table", ("ads",), 15 * 60),
+    "adr": endpoint_policy("adr", ("ga4",), 15 * 60),
+    "dials": endpoint_policy("dials", ("ads",), 10 * 60),
+    # campaign status/name are current values even for old ranges → shorter settled TTL
+    "ads-campaigns": endpoint_policy("ads-campaigns", ("ads",), 10 * 60, 6 * 3600),
+    "ads-networks": endpoint_policy("ads-networks", ("ads",), 10 * 60),
+}
+
+
+def range_settled(sources: Tuple[str, ...], end: str) -> bool:
+    """True if no source can still revise data up to `end` (YYYY-MM-DD)."""
+    if not sources:
+        return False
+    try:
+        last = datetime.strptime(end, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return False
+    marks = {"ga4": ga4_settled_until, "ads": ads_settled_until}
+    return all(last <= marks[src]() for src in sources)
+
+
+def cache_policy(endpoint: str, end: str) -> CachePolicy:
+    """SWR policy for `endpoint` over a range ending at `end`."""
+    policy = ENDPOINT_CACHE_POLICIES[endpoint]
+    if range_settled(policy.sources, end):
+        return swr_policy(policy.settled_ttl)
+    return swr_policy(policy.moving_ttl)
 
 # -------------------- UTILS --------------------
 
@@ -267,17 +1359,107 @@ def _is_pt_br_label(label: str) -> bool:
     low = label.lower()
     return any(tok in low for tok in _PT_HINTS)
 
-def _alias_from_candidates(names: Dict[str, float], item_id: Optional[str] = None) -> Optional[str]:
-    # Try alias by normalized candidate names first (by highest revenue preference)
-    sorted_names = sorted(names.items(), key=lambda x: x[1], reverse=True)
-    for nm, _ in sorted_names:
-        key = _normalize_name_key(nm)
-        if key in ALIAS_PT:
-            return ALIAS_PT[key]
-    # Then by item_id (if specific mapping exists)
-    if item_id and item_id in ALIAS_PT:
-        return ALIAS_PT[item_id]
-    return None
+# -------------------- ITEM LABEL CATALOG --------------------
+# GA4 item names barely change, so their normalized key / PT-BR flag and the canonical
+# label of each item (itemId or normalized name) are resolved once, kept in memory,
+# persisted in the fact store and reloaded at startup. A label is only recomputed
+# when a new name shows up for its item or ALIAS_PT changes.
+
+class ItemLabelCatalog:
+    def __init__(self):
+        self.names: Dict[str, Tuple[str, bool]] = {}  # raw name -> (normalized key, looks PT-BR)
+        self.labels: Dict[str, Tuple[str, frozenset]] = {}  # item key -> (label, names seen)
+        self.alias_sig = hashlib.sha256(json.dumps(ALIAS_PT, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        self._new_names: Dict[str, Tuple[str, bool]] = {}
+        self._new_labels: Dict[str, Tuple[str, frozenset]] = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        conn = facts_db()
+        if conn is None:
+            return
+        try:
+            with _facts_lock:
+                names = conn.execute("SELECT name, norm_key, is_pt FROM item_names").fetchall()
+                labels = conn.execute(
+                    "SELECT key, label, names FROM item_labels WHERE alias_sig = ?", (self.alias_sig,)
+                ).fetchall()
+        except Exception as e:
+            print(f"[CATALOG] load failed: {e}")
+            return
+        with self._lock:
+            self.names.update({n: (k, bool(pt)) for n, k, pt in names})
+            self.labels.update({k: (lab, frozenset(json.loads(ns))) for k, lab, ns in labels})
+        print(f"[CATALOG] {len(names)} item names, {len(labels)} labels loaded")
+
+    def name_info(self, name: str) -> Tuple[str, bool]:
+        info = self.names.get(name)
+        if info is None:
+            info = (_normalize_name_key(name), _is_pt_br_label(name))
+            with self._lock:
+                self.names[name] = self._new_names[name] = info
+        return info
+
+    def norm(self, name: str) -> str:
+        return self.name_info(name)[0]
+
+    def label(self, key: str, candidates: Dict[str, float], item_id: Optional[str] = None) -> str:
+        """Canonical label of an item; `candidates` are its raw names with their revenue."""
+        entry = self.labels.get(key)
+        if entry is not None and entry[1].issuperset(candidates):
+            return entry[0]
+        seen = frozenset(candidates) | (entry[1] if entry else frozenset())
+        label = self._resolve(candidates, item_id)
+        with self._lock:
+            self.labels[key] = self._new_labels[key] = (label, seen)
+        return label
+
+    def _resolve(self, candidates: Dict[str, float], item_id: Optional[str]) -> str:
+        # Prefer explicit alias (by highest revenue candidate, then itemId)
+        for nm, _ in sorted(candidates.items(), key=lambda x: x[1], reverse=True):
+            alias = ALIAS_PT.get(self.norm(nm))
+            if alias:
+                return alias
+        if item_id and item_id in ALIAS_PT:
+            return ALIAS_PT[item_id]
+        # Otherwise prefer a PT-BR looking label among candidates
+        pt = [(nm, rv) for nm, rv in candidates.items() if self.name_info(nm)[1]]
+        if pt:
+            return max(pt, key=lambda x: x[1])[0]
+        return max(candidates.items(), key=lambda x: x[1])[0]
+
+    def flush(self):
+        """Persist names/labels learned since the last flush."""
+        with self._lock:
+            names, self._new_names = self._new_names, {}
+            labels, self._new_labels = self._new_labels, {}
+        if not names and not labels:
+            return
+        conn = facts_db()
+        if conn is None:
+            return
+        now = datetime.utcnow().timestamp()
+        try:
+            with _facts_lock:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO item_names (name, norm_key, is_pt) VALUES (?, ?, ?)",
+                    [(n, k, int(pt)) for n, (k, pt) in names.items()],
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO item_labels (key, label, names, alias_sig, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    [(k, lab, json.dumps(sorted(ns), ensure_ascii=False), self.alias_sig, now) for k, (lab, ns) in labels.items()],
+                )
+                conn.commit()
+        except Exception as e:
+            print(f"[CATALOG] write failed: {e}")
+
+
+item_labels = ItemLabelCatalog()
+
+
+@app.on_event("startup")
+async def load_item_labels():
+    await run_blocking("ga4", item_labels.load)
 
 # -------------------- CONSTANTS --------------------
 CHANNELS = ["Organic Search", "Paid Search", "Direct", "Paid Social", "Organic Social", "Referral", "Display"]
@@ -399,44 +1581,267 @@ def mock_acquisition_timeseries(metric: str, start: datetime, end: datetime) ->
         points.append({"date": d.strftime("%Y-%m-%d"), "values": values})
     return points
 
+# -------------------- FACT STORE (SQLite) --------------------
+
+_FACTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ga4_partitions (
+    property TEXT NOT NULL,
+    dimset TEXT NOT NULL,
+    day TEXT NOT NULL,
+    rows TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (property, dimset, day)
+);
+CREATE TABLE IF NOT EXISTS ads_days (
+    customer TEXT NOT NULL,
+    day TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (customer, day)
+);
+CREATE TABLE IF NOT EXISTS ads_facts (
+    customer TEXT NOT NULL,
+    day TEXT NOT NULL,
+    campaign_id TEXT NOT NULL,
+    network TEXT NOT NULL,
+    clicks INTEGER NOT NULL,
+    impressions INTEGER NOT NULL,
+    cost_micros INTEGER NOT NULL,
+    conversions REAL NOT NULL,
+    conv_value REAL NOT NULL,
+    PRIMARY KEY (customer, day, campaign_id, network)
+);
+CREATE TABLE IF NOT EXISTS ads_campaigns (
+    customer TEXT NOT NULL,
+    campaign_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    channel_type TEXT NOT NULL,
+    status TEXT NOT NULL,
+    primary_status TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (customer, campaign_id)
+);
+CREATE TABLE IF NOT EXISTS monthly_reports (
+    month TEXT NOT NULL,
+    data_hash TEXT NOT NULL,
+    body TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (month, data_hash)
+);
+CREATE TABLE IF NOT EXISTS item_names (
+    name TEXT PRIMARY KEY,
+    norm_key TEXT NOT NULL,
+    is_pt INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS item_labels (
+    key TEXT PRIMARY KEY,
+    label TEXT NOT NULL,
+    names TEXT NOT NULL,
+    alias_sig TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+_facts_lock = threading.RLock()
+_facts_conn: Optional[sqlite3.Connection] = None
+
+
+def facts_db() -> Optional[sqlite3.Connection]:
+    """Shared connection to the local fact store (None if the file can't be opened)."""
+    global _facts_conn
+    with _facts_lock:
+        if _facts_conn is not None:
+            return _facts_conn
+        try:
+            Path(FACTS_DB_PATH).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(FACTS_DB_PATH, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_FACTS_SCHEMA)
+            conn.commit()
+            _facts_conn = conn
+        except Exception as e:
+            print(f"[STORE] init failed: {e}")
+            return None
+        return _facts_conn
+
+
+# -------------------- GA4 DAY STORE --------------------
+# One partition per (property, dimension set, day). A range is assembled from the
+# stored days and GA4 is only asked for the missing span. The last
+# GA4_STORE_LAG_DAYS are still revised by GA4, so they are fetched but never persisted.
+
+def ga4_dimset_key(dims: List[str], metrics: List[str]) -> str:
+    return ",".join(list(dims) + ["date"]) + "|" + ",".join(metrics)
+
+
+def ga4_settled_until() -> date:
+    """Last day whose GA4 numbers are considered final."""
+    return datetime.utcnow().date() - timedelta(days=GA4_STORE_LAG_DAYS)
+
+
+def ga4_store_read(dimset: str, days: List[str]) -> Dict[str, List[list]]:
+    conn = facts_db()
+    if conn is None or not days:
+        return {}
+    try:
+        with _facts_lock:
+            found = conn.execute(
+                "SELECT day, rows FROM ga4_partitions WHERE property = ? AND dimset = ? AND day BETWEEN ? AND ?",
+                (GA4_PROPERTY_ID, dimset, days[0], days[-1]),
+            ).fetchall()
+    except Exception as e:
+        print(f"[STORE] ga4 read failed: {e}")
+        return {}
+    return {d: json.loads(rows) for d, rows in found}
+
+
+def ga4_store_write(dimset: str, partitions: Dict[str, List[list]]):
+    conn = facts_db()
+    if conn is None:
+        return
+    settled = ga4_settled_until().isoformat()
+    now = datetime.utcnow().timestamp()
+    items = [
+        (GA4_PROPERTY_ID, dimset, d, json.dumps(rows, ensure_ascii=False), now)
+        for d, rows in partitions.items() if d <= settled
+    ]
+    if not items:
+        return
+    try:
+        with _facts_lock:
+            conn.executemany(
+                "INSERT OR REPLACE INTO ga4_partitions (property, dimset, day, rows, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                items,
+            )
+            conn.commit()
+    except Exception as e:
+        print(f"[STORE] ga4 write failed: {e}")
+
+
+def ga4_partitions_plan(dims: List[str], metrics: List[str], start: str, end: str):
+    """
+    Stored daily partitions for start..end plus the report that covers the missing span.
+    Returns (parts, request, ingest): request is None when every day is stored; otherwise
+    ingest(response) persists that report and completes `parts` in place. Blocking: when
+    the report has more rows than one page, ingest fetches the remaining pages first.
+    """
+    from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, RunReportRequest
+
+    s_dt, e_dt = parse_dates(start, end)
+    days = [d.strftime("%Y-%m-%d") for d in daterange(s_dt, e_dt)]
+    dimset = ga4_dimset_key(dims, metrics)
+    parts = ga4_store_read(dimset, days)
+    missing = [d for d in days if d not in parts]
+    if not missing:
+        return parts, None, lambda resp: None
+
+    def page(offset: int = 0):
+        return RunReportRequest(
+            property=f"properties/{GA4_PROPERTY_ID}",
+            dimensions=[Dimension(name=n) for n in list(dims) + ["date"]],
+            metrics=[Metric(name=m) for m in metrics],
+            date_ranges=[DateRange(start_date=missing[0], end_date=missing[-1])],
+            limit=GA4_STORE_PAGE_ROWS,
+            offset=offset,
+        )
+
+    def ingest(resp):
+        rows = list(resp.rows)
+        while len(rows) < resp.row_count:
+            more = ga4_run_report(page(len(rows))).rows
+            if not more:
+                break
+            rows.extend(more)
+        if len(rows) < resp.row_count:
+            # days assembled from a truncated report would be stored as final
+            raise RuntimeError(f"GA4 report for {dimset} returned {len(rows)} of {resp.row_count} rows")
+        fetched: Dict[str, List[list]] = {d: [] for d in days if missing[0] <= d <= missing[-1]}
+        n_dims = len(dims)
+        for row in rows:
+            d_raw = row.dimension_values[n_dims].value or ""
+            d_iso = f"{d_raw[:4]}-{d_raw[4:6]}-{d_raw[6:8]}"
+            if d_iso not in fetched:
+                continue
+            dim_vals = [(row.dimension_values[i].value or "").strip() for i in range(n_dims)]
+            fetched[d_iso].append(dim_vals + [float(mv.value or 0) for mv in row.metric_values])
+        ga4_store_write(dimset, fetched)
+        parts.update(fetched)
+
+    return parts, page(), ingest
+
+
+def ga4_fetch_partitions(dims: List[str], metrics: List[str], start: str, end: str) -> Optional[Dict[str, List[list]]]:
+    """
+    Daily partitions for start..end: {'YYYY-MM-DD': [[dim..., metric...], ...]}.
+    Stored days are read locally; the missing span is fetched with a single report.
+    GA4 errors are raised so callers keep their own fallbacks.
+    """
+    if not GA4_PROPERTY_ID or not get_ga4_client():
+        return None
+    parts, req, ingest = ga4_partitions_plan(dims, metrics, start, end)
+    if req is not None:
+        ingest(ga4_run_report(req))
+    return parts
+
+
+# -------------------- GA4 BATCH --------------------
+
+class GA4ReportBatch:
+    """
+    Collects RunReportRequests for GA4_PROPERTY_ID and sends them with
+    batch_run_reports (up to 5 reports per RPC). Each response is handed back
+    to the callback registered with its request.
+    """
+    MAX_REPORTS = 5
+
+    def __init__(self):
+        self.items: List[Tuple[Any, Any]] = []
+
+    def add(self, req, on_response):
+        self.items.append((req, on_response))
+
+    def run(self):
+        from google.analytics.data_v1beta.types import BatchRunReportsRequest
+        for i in range(0, len(self.items), self.MAX_REPORTS):
+            chunk = self.items[i:i + self.MAX_REPORTS]
+            if len(chunk) == 1:
+                req, on_response = chunk[0]
+                on_response(ga4_run_report(req))
+                continue
+            for req, _ in chunk:
+                req.return_property_quota = True
+            t0 = time.perf_counter()
+            resp = get_ga4_client().batch_run_reports(BatchRunReportsRequest(
+                property=f"properties/{GA4_PROPERTY_ID}",
+                requests=[req for req, _ in chunk],
+            ))
+            ga4_observe("batch_run_reports", t0, resp)
+            for (_, on_response), report in zip(chunk, resp.reports):
+                on_response(report)
+        self.items = []
+
+
 # -------------------- INTEGRATIONS (GA4/ADS) --------------------
 
 def ga4_revenue_qty_by_date(start: str, end: str) -> Optional[List[Dict[str, Any]]]:
     """
     Strict logic requested: by date of sale only.
-    Query GA4 grouped by date with metrics itemRevenue and itemsPurchased.
+    Daily itemRevenue and itemsPurchased, assembled from the GA4 day store.
     Returns list of {date: 'DD/MM/YY', revenue: float, qty: float}
     """
-    if not ga4_client or not GA4_PROPERTY_ID:
+    if not GA4_PROPERTY_ID or not get_ga4_client():
         return None
-    from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, RunReportRequest
 
     s_dt, e_dt = parse_dates(start, end)
     try:
-        req = RunReportRequest(
-            property=f"properties/{GA4_PROPERTY_ID}",
-            dimensions=[Dimension(name="date")],
-            metrics=[Metric(name="itemRevenue"), Metric(name="itemsPurchased")],
-            date_ranges=[DateRange(start_date=start, end_date=end)],
-            limit=250000,
-        )
-        resp = ga4_client.run_report(req)
-        bucket: Dict[str, Dict[str, float]] = {}
-        for row in resp.rows:
-            d_raw = row.dimension_values[0].value
-            try:
-                d = datetime.strptime(d_raw, "%Y%m%d")
-            except Exception:
-                continue
-            k = fmt_ddmmyy(d)
-            rev = float(row.metric_values[0].value or 0)
-            qty = float(row.metric_values[1].value or 0)
-            bucket[k] = {"revenue": round(rev, 2), "qty": round(qty, 4)}
+        parts = ga4_fetch_partitions([], ["itemRevenue", "itemsPurchased"], start, end)
+        if parts is None:
+            return None
         out = []
         for d in daterange(s_dt, e_dt):
-            k = fmt_ddmmyy(d)
-            cell = bucket.get(k, {"revenue": 0.0, "qty": 0.0})
-            out.append({"date": k, **cell})
+            rows = parts.get(d.strftime("%Y-%m-%d")) or []
+            rev = sum(r[0] for r in rows)
+            qty = sum(r[1] for r in rows)
+            out.append({"date": fmt_ddmmyy(d), "revenue": round(rev, 2), "qty": round(qty, 4)})
         return out
     except Exception as e:
         print(f"[GA4] revenue/qty by date failed: {e}")
@@ -448,41 +1853,30 @@ def ads_enabled_campaign_totals(start: str, end: str) -> Optional[Dict[str, Any]
     Totais agregados para KPIs dos dials (CR e ROAS) no período.
     Retorna: {"clicks", "conversions", "value", "cost", "cr", "roas"}
     """
-    if not ads_client or not ADS_CUSTOMER_ID:
+    if not ADS_CUSTOMER_ID or not get_ads_client():
         return None
 
-    service = ads_client.get_service("GoogleAdsService")
-    customer_id = ADS_CUSTOMER_ID.replace("-", "")
-
-    query = f"""
-        SELECT
-          metrics.clicks,
-          metrics.conversions,
-          metrics.conversions_value,
-          metrics.cost_micros
-        FROM campaign
-        WHERE segments.date BETWEEN '{start}' AND '{end}'
-          AND metrics.impressions > 0
-    """
-
-    print(f"[DEBUG] GAQL (ads_enabled_campaign_totals):\n{query}")
-
     try:
-        resp = service.search(customer_id=customer_id, query=query)
+        facts = ads_store_rows(start, end)
     except Exception as e:
         print(f"[ERROR] ads_enabled_campaign_totals: {e}")
         return None
+    if facts is None:
+        return None
 
     clicks = 0
     conv = 0.0
     conv_value = 0.0
     cost = 0.0
 
-    for row in resp:
-        clicks += int(row.metrics.clicks or 0)
-        conv += float(row.metrics.conversions or 0)
-        conv_value += float(row.metrics.conversions_value or 0)
-        cost += (row.metrics.cost_micros or 0) / 1_000_000
+    # Mesmo critério do GAQL anterior: campanhas com impressões no período
+    for row in ads_group(facts, lambda f: f["campaign_id"]).values():
+        if row["impressions"] <= 0:
+            continue
+        clicks += row["clicks"]
+        conv += row["conversions"]
+        conv_value += row["conv_value"]
+        cost += row["cost"]
 
     cr = (conv / clicks) if clicks else 0.0
     roas = (conv_value / cost) if cost else 0.0
@@ -498,25 +1892,21 @@ def ads_enabled_campaign_totals(start: str, end: str) -> Optional[Dict[str, Any]
 
 
 def ga4_sum_item_revenue(start: str, end: str) -> Optional[float]:
-    if not ga4_client or not GA4_PROPERTY_ID:
+    if not GA4_PROPERTY_ID or not get_ga4_client():
+        return None
+    # itemRevenue is additive: the period total is the sum of the stored daily partitions
+    parts = ga4_fetch_partitions([], ["itemRevenue", "itemsPurchased"], start, end)
+    if parts is None:
         return None
-    from google.analytics.data_v1beta.types import DateRange, Metric, RunReportRequest
-    # Query without dimensions to get total directly
-    req = RunReportRequest(
-        property=f"properties/{GA4_PROPERTY_ID}",
-        metrics=[Metric(name="itemRevenue")],
-        date_ranges=[DateRange(start_date=start, end_date=end)],
-    )
-    resp = ga4_client.run_report(req)
     total = 0.0
-    for row in resp.rows:
-        total += float(row.metric_values[0].value or 0)
+    for rows in parts.values():
+        for r in rows:
+            total += r[0]
     return round(total, 2)
 
 
-def ga4_count_reservations(start: str, end: str) -> Optional[int]:
-    if not ga4_client or not GA4_PROPERTY_ID:
-        return None
+def ga4_reservations_requests(start: str, end: str):
+    """(purchase eventCount report, conversions fallback report) for the period."""
     from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, RunReportRequest, FilterExpression, Filter
     req = RunReportRequest(
         property=f"properties/{GA4_PROPERTY_ID}",
@@ -525,200 +1915,489 @@ def ga4_count_reservations(start: str, end: str) -> Optional[int]:
         date_ranges=[DateRange(start_date=start, end_date=end)],
         dimension_filter=FilterExpression(filter=Filter(field_name="eventName", string_filter=Filter.StringFilter(value="purchase")))
     )
-    resp = ga4_client.run_report(req)
-    if not resp.rows:
-        # fallback opcional para conversions
-        req2 = RunReportRequest(
-            property=f"properties/{GA4_PROPERTY_ID}",
-            dimensions=[Dimension(name="date")],
-            metrics=[Metric(name="conversions")],
-            date_ranges=[DateRange(start_date=start, end_date=end)],
-            limit=1,
-        )
-        resp2 = ga4_client.run_report(req2)
-        total = 0
-        for r in resp2.rows:
-            total += int(r.metric_values[0].value or 0)
-        return total
+    # fallback opcional para conversions
+    req2 = RunReportRequest(
+        property=f"properties/{GA4_PROPERTY_ID}",
+        dimensions=[Dimension(name="date")],
+        metrics=[Metric(name="conversions")],
+        date_ranges=[DateRange(start_date=start, end_date=end)],
+        limit=1,
+    )
+    return req, req2
+
+
+def ga4_sum_first_metric(resp) -> int:
     total = 0
     for r in resp.rows:
         total += int(r.metric_values[0].value or 0)
     return total
 
 
+def ga4_count_reservations(start: str, end: str) -> Optional[int]:
+    if not GA4_PROPERTY_ID or not get_ga4_client():
+        return None
+    req, req2 = ga4_reservations_requests(start, end)
+    resp = ga4_run_report(req)
+    if not resp.rows:
+        return ga4_sum_first_metric(ga4_run_report(req2))
+    return ga4_sum_first_metric(resp)
+
+
+def ga4_kpi_totals(start: str, end: str) -> Optional[Dict[str, Any]]:
+    """
+    Receita (Σ itemRevenue), Reservas (purchase, fallback conversions) and
+    Diárias (Σ itemsPurchased) for one period, batched into a single batch_run_reports call.
+    The conversions report is only sent when purchase has no rows. If the batch fails
+    (it fails as a whole) each metric is retried on its own; a metric that still fails
+    is None so callers can fall back per metric. Raises only when every metric failed.
+    """
+    if not GA4_PROPERTY_ID or not get_ga4_client():
+        return None
+    batch = GA4ReportBatch()
+    parts, req_days, ingest = ga4_partitions_plan([], ["itemRevenue", "itemsPurchased"], start, end)
+    if req_days is not None:
+        batch.add(req_days, ingest)
+    responses: Dict[str, Any] = {}
+    req_purchase, req_conv = ga4_reservations_requests(start, end)
+    batch.add(req_purchase, lambda resp: responses.__setitem__("purchase", resp))
+    try:
+        batch.run()
+    except Exception as e:
+        print(f"[GA4] kpi batch failed, retrying per metric: {e}")
+        return ga4_kpi_totals_separately(start, end)
+
+    receita = sum(r[0] for rows in parts.values() for r in rows)
+    diarias = sum(r[1] for rows in parts.values() for r in rows)
+    purchase = responses["purchase"]
+    reservas: Optional[int] = ga4_sum_first_metric(purchase)
+    if not purchase.rows:
+        try:
+            reservas = ga4_sum_first_metric(ga4_run_report(req_conv))
+        except Exception as e:
+            print(f"[GA4] kpi conversions fallback failed: {e}")
+            reservas = None
+    return {"receita": round(receita, 2), "reservas": reservas, "diarias": diarias}
+
+
+def ga4_kpi_totals_separately(start: str, end: str) -> Dict[str, Any]:
+    """ga4_kpi_totals without batching: revenue/diárias and reservas fail independently."""
+    out: Dict[str, Any] = {"receita": None, "reservas": None, "diarias": None}
+    errors = []
+    try:
+        parts = ga4_fetch_partitions([], ["itemRevenue", "itemsPurchased"], start, end) or {}
+        out["receita"] = round(sum(r[0] for rows in parts.values() for r in rows), 2)
+        out["diarias"] = sum(r[1] for rows in parts.values() for r in rows)
+    except Exception as e:
+        print(f"[GA4] kpi receita/diárias failed: {e}")
+        errors.append(e)
+    try:
+        out["reservas"] = ga4_count_reservations(start, end)
+    except Exception as e:
+        print(f"[GA4] kpi reservas failed: {e}")
+        errors.append(e)
+    if len(errors) == 2:
+        raise errors[0]
+    return out
+
+
+def ga4_item_columns(parts: Dict[str, List[list]], days: List[str], key_for):
+    """
+    Columnar view of per-day item partitions.
+    key_for(row) -> (key, name, value). Returns (keys, matrix, candidates): `matrix` is a
+    len(keys) x len(days) array of summed values (keys in first-seen order) and
+    candidates[i] maps each raw item name of keys[i] to its total value.
+    """
+    key_codes: Dict[str, int] = {}
+    name_codes: Dict[str, int] = {}
+    resolved: Dict[tuple, Tuple[int, int]] = {}  # raw dims -> (key code, name code)
+    day_idx: List[int] = []
+    kcol: List[int] = []
+    ncol: List[int] = []
+    vcol: List[float] = []
+    for i, day in enumerate(days):
+        for row in parts.get(day) or []:
+            dims = tuple(row[:-1])
+            codes = resolved.get(dims)
+            if codes is None:
+                key, name, _ = key_for(row)
+                codes = resolved[dims] = (
+                    key_codes.setdefault(key, len(key_codes)),
+                    name_codes.setdefault(name, len(name_codes)),
+                )
+            day_idx.append(i)
+            kcol.append(codes[0])
+            ncol.append(codes[1])
+            vcol.append(row[-1])
+
+    keys = list(key_codes)
+    nk, nd, nn = len(keys), len(days), len(name_codes)
+    if not vcol:
+        return keys, np.zeros((0, nd)), []
+    k_arr = np.asarray(kcol, dtype=np.int64)
+    n_arr = np.asarray(ncol, dtype=np.int64)
+    v_arr = np.asarray(vcol, dtype=np.float64)
+    matrix = np.bincount(k_arr * nd + np.asarray(day_idx, dtype=np.int64), weights=v_arr, minlength=nk * nd).reshape(nk, nd)
+
+    # label candidates: value per (key, name) pair
+    pairs, inverse = np.unique(k_arr * nn + n_arr, return_inverse=True)
+    pair_vals = np.bincount(inverse, weights=v_arr)
+    names = list(name_codes)
+    candidates: List[Dict[str, float]] = [{} for _ in keys]
+    for pair, val in zip(pairs.tolist(), pair_vals.tolist()):
+        candidates[pair // nn][names[pair % nn]] = val
+    return keys, matrix, candidates
+
+
 def ga4_revenue_by_item_per_day(start: str, end: str) -> Optional[List[Dict[str, Any]]]:
-    if not ga4_client or not GA4_PROPERTY_ID:
+    if not GA4_PROPERTY_ID or not get_ga4_client():
         return None
-    from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, RunReportRequest
 
     s_dt, e_dt = parse_dates(start, end)
-    date_labels = [fmt_ddmmyy(d) for d in daterange(s_dt, e_dt)]
-
-    def build_points(group_map: Dict[str, Dict[str, float]], label_map: Dict[str, str]) -> List[Dict[str, Any]]:
-        # include only items with total > 0
-        keys_included = [k for k, per in group_map.items() if sum(per.values()) > 0]
-        # map each key to canonical label and collapse non-"Quarto" into 'Extras'
-        def canonical_label_for(k: str) -> str:
-            base = label_map.get(k, str(k))
-            if not base:
-                return "Extras"
-            low = base.lower().strip()
-            if not low.startswith("quarto"):
-                return "Extras"
-            return base
-        # aggregate per final label per day
-        agg: Dict[str, Dict[str, float]] = {}
-        for k in keys_included:
-            lab = canonical_label_for(k)
-            for d, v in group_map.get(k, {}).items():
-                agg.setdefault(lab, {})
-                agg[lab][d] = agg[lab].get(d, 0.0) + float(v or 0)
-        # build points with zero-fill
-        pts: List[Dict[str, Any]] = []
-        for d in date_labels:
-            values = {lab: round(agg.get(lab, {}).get(d, 0.0), 2) for lab in agg.keys()}
-            pts.append({"date": d, "values": values})
-        return pts
+    calendar = list(daterange(s_dt, e_dt))
+    days = [d.strftime("%Y-%m-%d") for d in calendar]
+    date_labels = [fmt_ddmmyy(d) for d in calendar]
+
+    def canonical_label(k: str, cand: Dict[str, float], by_id: bool) -> str:
+        return item_labels.label(k, cand, item_id=k if by_id and not str(k).startswith("_noid::") else None)
+
+    def build_points(keys: List[str], matrix, candidates: List[Dict[str, float]], by_id: bool) -> List[Dict[str, Any]]:
+        # include only items with total > 0; map each to its canonical label and
+        # collapse non-"Quarto" into 'Extras'
+        label_codes: Dict[str, int] = {}
+        rows: List[int] = []
+        codes: List[int] = []
+        for i in np.flatnonzero(matrix.sum(axis=1) > 0).tolist():
+            lab = canonical_label(keys[i], candidates[i], by_id)
+            if not lab or not lab.lower().strip().startswith("quarto"):
+                lab = "Extras"
+            rows.append(i)
+            codes.append(label_codes.setdefault(lab, len(label_codes)))
+        # aggregate per final label per day (zero-filled)
+        agg = np.zeros((len(label_codes), len(days)))
+        np.add.at(agg, codes, matrix[rows])
+        labels = list(label_codes)
+        item_labels.flush()
+        return [
+            {"date": d, "values": dict(zip(labels, col))}
+            for d, col in zip(date_labels, np.round(agg, 2).T.tolist())
+        ]
 
     # Try with itemId + itemName + date (preferred)
+    parts_id: Optional[Dict[str, List[list]]] = None
     try:
-        req_id = RunReportRequest(
-            property=f"properties/{GA4_PROPERTY_ID}",
-            dimensions=[Dimension(name="itemId"), Dimension(name="itemName"), Dimension(name="date")],
-            metrics=[Metric(name="itemRevenue")],
-            date_ranges=[DateRange(start_date=start, end_date=end)],
-            limit=250000,
+        parts_id = ga4_fetch_partitions(["itemId", "itemName"], ["itemRevenue"], start, end)
+        if parts_id is None:
+            return None
+        has_id = any(r[0] for rows in parts_id.values() for r in rows)
+        keys, matrix, candidates = ga4_item_columns(
+            parts_id, days, lambda r: (r[0] if r[0] else f"_noid::{item_labels.norm(r[1])}", r[1], r[2])
         )
-        resp_id = ga4_client.run_report(req_id)
-        has_id = False
-        group: Dict[str, Dict[str, float]] = {}
-        labels: Dict[str, Dict[str, float]] = {}
-        for row in resp_id.rows:
-            item_id = (row.dimension_values[0].value or "").strip()
-            name = (row.dimension_values[1].value or "").strip()
-            d_raw = row.dimension_values[2].value
-            if item_id:
-                has_id = True
-            try:
-                d_fmt = fmt_ddmmyy(datetime.strptime(d_raw, "%Y%m%d"))
-            except Exception:
-                continue
-            val = float(row.metric_values[0].value or 0)
-            key = item_id if item_id else f"_noid::{_normalize_name_key(name)}"
-            group.setdefault(key, {})
-            group[key][d_fmt] = group[key].get(d_fmt, 0.0) + val
-            labels.setdefault(key, {})
-            labels[key][name] = labels[key].get(name, 0.0) + val
-        if has_id and group:
-            canonical: Dict[str, str] = {}
-            for k, cand in labels.items():
-                # Prefer explicit alias if available
-                alias = _alias_from_candidates(cand, item_id=k if not str(k).startswith("_noid::") else None)
-                if alias:
-                    canonical[k] = alias
-                    continue
-                # Otherwise prefer a PT-BR looking label among candidates
-                pt = [(nm, rv) for nm, rv in cand.items() if _is_pt_br_label(nm)]
-                if pt:
-                    canonical[k] = max(pt, key=lambda x: x[1])[0]
-                else:
-                    canonical[k] = max(cand.items(), key=lambda x: x[1])[0]
-            return build_points(group, canonical)
+        if has_id and keys:
+            return build_points(keys, matrix, candidates, by_id=True)
     except Exception as e:
         print(f"[GA4] itemId path failed: {e}")
+        parts_id = None
 
-    # Fallback to itemName + date normalization
-    req = RunReportRequest(
-        property=f"properties/{GA4_PROPERTY_ID}",
-        dimensions=[Dimension(name="itemName"), Dimension(name="date")],
-        metrics=[Metric(name="itemRevenue")],
-        date_ranges=[DateRange(start_date=start, end_date=end)],
-        limit=250000,
-    )
-    resp = ga4_client.run_report(req)
-    group2: Dict[str, Dict[str, float]] = {}
-    labels2: Dict[str, Dict[str, float]] = {}
-    for row in resp.rows:
-        name = (row.dimension_values[0].value or "").strip()
-        d_raw = row.dimension_values[1].value
-        try:
-            d_fmt = fmt_ddmmyy(datetime.strptime(d_raw, "%Y%m%d"))
-        except Exception:
-            continue
-        val = float(row.metric_values[0].value or 0)
-        key = _normalize_name_key(name)
-        group2.setdefault(key, {})
-        group2[key][d_fmt] = group2[key].get(d_fmt, 0.0) + val
-        labels2.setdefault(key, {})
-        labels2[key][name] = labels2[key].get(name, 0.0) + val
-    canonical2: Dict[str, str] = {}
-    for k, cand in labels2.items():
-        # Try explicit alias first
-        alias = _alias_from_candidates(cand)
-        if alias:
-            canonical2[k] = alias
+    # Fallback to itemName + date normalization (reuses the itemId partitions when they were fetched)
+    if parts_id is not None:
+        cols = ga4_item_columns(parts_id, days, lambda r: (item_labels.norm(r[1]), r[1], r[2]))
+    else:
+        parts_name = ga4_fetch_partitions(["itemName"], ["itemRevenue"], start, end) or {}
+        cols = ga4_item_columns(parts_name, days, lambda r: (item_labels.norm(r[0]), r[0], r[1]))
+    return build_points(*cols, by_id=False)
+
+# -------------------- ADS DAY STORE --------------------
+# Per-day, per-campaign, per-network metric rows plus a tracker of fetched days.
+# This is the single Ads query behind every Ads widget (table, campaigns, dials, KPI
+# totals, network shares): each range only asks Google Ads for the days that are not
+# stored yet. Days newer than ADS_STORE_LAG_DAYS are only trusted for
+# ADS_RECENT_TTL_SECONDS, so one page load fetches them once instead of once per widget.
+# Campaign attributes come from a separate undated query (ADS_CAMPAIGNS_TTL_SECONDS):
+# dated rows skip zero-activity campaigns, so a paused one would keep an old status.
+
+def ads_settled_until() -> date:
+    """Last day whose Ads metrics are considered final."""
+    return datetime.utcnow().date() - timedelta(days=ADS_STORE_LAG_DAYS)
+
+
+def _enum_name(msg, field: str) -> str:
+    """Name of an enum field on a raw protobuf message (e.g. campaign.status → "ENABLED")."""
+    num = getattr(msg, field)
+    value = msg.DESCRIPTOR.fields_by_name[field].enum_type.values_by_number.get(num)
+    return value.name if value is not None else str(num)
+
+
+# span (customer, first, last) -> [lock, holders]; only fetches of the same span wait on each other
+_ads_fetch_locks: Dict[Tuple[str, str, str], list] = {}
+_ads_fetch_locks_guard = threading.Lock()
+
+
+@contextlib.contextmanager
+def ads_fetch_lock(span: Tuple[str, str, str]):
+    with _ads_fetch_locks_guard:
+        entry = _ads_fetch_locks.setdefault(span, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _ads_fetch_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                _ads_fetch_locks.pop(span, None)
+
+
+def ads_store_missing_days(customer_id: str, days: List[str]) -> List[str]:
+    if not days:  # empty or inverted range
+        return []
+    conn = facts_db()
+    if conn is None:
+        return list(days)
+    with _facts_lock:
+        fetched = conn.execute(
+            "SELECT day, fetched_at FROM ads_days WHERE customer = ? AND day BETWEEN ? AND ?",
+            (customer_id, days[0], days[-1]),
+        ).fetchall()
+    now = datetime.utcnow()
+    lag = timedelta(days=ADS_STORE_LAG_DAYS)
+    done = set()
+    for d, fetched_at in fetched:
+        at = datetime.utcfromtimestamp(fetched_at)
+        # final if the day had already settled when it was fetched, otherwise only briefly
+        if d <= (at.date() - lag).isoformat() or (now - at).total_seconds() < ADS_RECENT_TTL_SECONDS:
+            done.add(d)
+    return [d for d in days if d not in done]
+
+
+def ads_fetch_days(customer_id: str, first: str, last: str):
+    """Fetch campaign x date x network rows for first..last and replace them in the store."""
+    conn = facts_db()
+    if conn is None:
+        raise RuntimeError("fact store unavailable")
+    service = get_ads_client().get_service("GoogleAdsService")
+    query = f"""
+        SELECT
+          campaign.id,
+          campaign.name,
+          campaign.advertising_channel_type,
+          campaign.status,
+          campaign.primary_status,
+          segments.date,
+          segments.ad_network_type,
+          metrics.clicks,
+          metrics.impressions,
+          metrics.cost_micros,
+          metrics.conversions,
+          metrics.conversions_value
+        FROM campaign
+        WHERE segments.date BETWEEN '{first}' AND '{last}'
+    """
+    print(f"[DEBUG] GAQL (ads_fetch_days {first}..{last})")
+    # One streaming RPC instead of paged search; each batch is folded into the
+    # aggregates as it arrives and read through the raw protobuf (no proto-plus wrapping).
+    t0 = time.perf_counter()
+    stream = service.search_stream(customer_id=customer_id, query=query)
+
+    now = datetime.utcnow().timestamp()
+    facts: Dict[Tuple[str, str, str], List[float]] = {}
+    campaigns: Dict[str, Tuple[str, str, str, str]] = {}
+    n_rows = 0
+    for batch in stream:
+        results = type(batch).pb(batch).results
+        n_rows += len(results)
+        for row in results:
+            camp, seg, met = row.campaign, row.segments, row.metrics
+            cid = str(camp.id)
+            if cid not in campaigns:
+                campaigns[cid] = (
+                    camp.name,
+                    _enum_name(camp, "advertising_channel_type"),
+                    _enum_name(camp, "status"),
+                    _enum_name(camp, "primary_status"),
+                )
+            k = (seg.date, cid, _enum_name(seg, "ad_network_type"))
+            acc = facts.setdefault(k, [0, 0, 0, 0.0, 0.0])
+            acc[0] += met.clicks
+            acc[1] += met.impressions
+            acc[2] += met.cost_micros
+            acc[3] += met.conversions
+            acc[4] += met.conversions_value
+    ads_gaql_seconds.observe(time.perf_counter() - t0, "ads_fetch_days")
+    ads_gaql_rows.observe(n_rows, "ads_fetch_days")
+
+    s_dt, e_dt = parse_dates(first, last)
+    done_days = [d.strftime("%Y-%m-%d") for d in daterange(s_dt, e_dt)]
+    with _facts_lock:
+        conn.execute("DELETE FROM ads_facts WHERE customer = ? AND day BETWEEN ? AND ?", (customer_id, first, last))
+        conn.executemany(
+            "INSERT INTO ads_facts (customer, day, campaign_id, network, clicks, impressions, cost_micros, conversions, conv_value) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(customer_id, d, cid, net, *vals) for (d, cid, net), vals in facts.items()],
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO ads_campaigns (customer, campaign_id, name, channel_type, status, primary_status, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(customer_id, cid, *attrs, now) for cid, attrs in campaigns.items()],
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO ads_days (customer, day, fetched_at) VALUES (?, ?, ?)",
+            [(customer_id, d, now) for d in done_days],
+        )
+        conn.commit()
+
+
+_ads_campaigns_refreshed: Dict[str, float] = {}  # customer -> last full attribute refresh
+_ads_campaigns_lock = threading.Lock()
+
+
+def ads_refresh_campaigns(customer_id: str):
+    """Re-read name/type/status of every campaign (undated, one cheap query) once per TTL."""
+    with _ads_campaigns_lock:
+        now = datetime.utcnow().timestamp()
+        if now - _ads_campaigns_refreshed.get(customer_id, 0.0) < ADS_CAMPAIGNS_TTL_SECONDS:
+            return
+        conn = facts_db()
+        if conn is None:
+            return
+        service = get_ads_client().get_service("GoogleAdsService")
+        query = """
+            SELECT
+              campaign.id,
+              campaign.name,
+              campaign.advertising_channel_type,
+              campaign.status,
+              campaign.primary_status
+            FROM campaign
+        """
+        t0 = time.perf_counter()
+        campaigns = []
+        for batch in service.search_stream(customer_id=customer_id, query=query):
+            for row in type(batch).pb(batch).results:
+                camp = row.campaign
+                campaigns.append((
+                    customer_id, str(camp.id), camp.name,
+                    _enum_name(camp, "advertising_channel_type"),
+                    _enum_name(camp, "status"),
+                    _enum_name(camp, "primary_status"),
+                    now,
+                ))
+        ads_gaql_seconds.observe(time.perf_counter() - t0, "ads_refresh_campaigns")
+        ads_gaql_rows.observe(len(campaigns), "ads_refresh_campaigns")
+        with _facts_lock:
+            conn.executemany(
+                "INSERT OR REPLACE INTO ads_campaigns (customer, campaign_id, name, channel_type, status, primary_status, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                campaigns,
+            )
+            conn.commit()
+        _ads_campaigns_refreshed[customer_id] = now
+
+
+def ads_store_rows(start: str, end: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Daily fact rows for start..end (gap-only backfill from Google Ads first).
+    Each row: day, campaign_id, name, type, status, primary_status, network,
+    clicks, impressions, cost, conversions, conv_value.
+    Ads errors are raised so callers keep their own fallbacks.
+    """
+    if not ADS_CUSTOMER_ID or not get_ads_client():
+        return None
+    customer_id = ADS_CUSTOMER_ID.replace("-", "")
+    s_dt, e_dt = parse_dates(start, end)
+    days = [d.strftime("%Y-%m-%d") for d in daterange(s_dt, e_dt)]
+    # widgets of the same page ask for the same range concurrently: the first one
+    # fetches, the others wait on that span and then find nothing missing
+    missing = ads_store_missing_days(customer_id, days)
+    if missing:
+        with ads_fetch_lock((customer_id, missing[0], missing[-1])):
+            missing = ads_store_missing_days(customer_id, days)
+            if missing:
+                ads_fetch_days(customer_id, missing[0], missing[-1])
+    try:
+        ads_refresh_campaigns(customer_id)
+    except Exception as e:
+        # metrics are still right; only name/status may lag until the next refresh
+        print(f"[ADS] campaign attributes refresh failed: {e}")
+
+    conn = facts_db()
+    with _facts_lock:
+        cur = conn.execute(
+            """
+            SELECT f.day, f.campaign_id, c.name, c.channel_type, c.status, c.primary_status, f.network,
+                   f.clicks, f.impressions, f.cost_micros, f.conversions, f.conv_value
+            FROM ads_facts f
+            LEFT JOIN ads_campaigns c ON c.customer = f.customer AND c.campaign_id = f.campaign_id
+            WHERE f.customer = ? AND f.day BETWEEN ? AND ?
+            """,
+            (customer_id, start, end),
+        )
+        found = cur.fetchall()
+    return [
+        {
+            "day": d, "campaign_id": cid, "name": name or cid, "type": ctype or "UNKNOWN",
+            "status": status or "UNKNOWN", "primary_status": pstatus or "UNKNOWN", "network": net,
+            "clicks": clicks, "impressions": imps, "cost": cost_micros / 1_000_000,
+            "conversions": conv, "conv_value": conv_value,
+        }
+        for d, cid, name, ctype, status, pstatus, net, clicks, imps, cost_micros, conv, conv_value in found
+    ]
+
+
+def ads_group(facts: List[Dict[str, Any]], key_fn) -> Dict[Any, Dict[str, Any]]:
+    """Sum the metric columns of fact rows per key (first row's attributes are kept)."""
+    out: Dict[Any, Dict[str, Any]] = {}
+    for f in facts:
+        k = key_fn(f)
+        acc = out.get(k)
+        if acc is None:
+            out[k] = dict(f)
             continue
-        pt = [(nm, rv) for nm, rv in cand.items() if _is_pt_br_label(nm)]
-        if pt:
-            canonical2[k] = max(pt, key=lambda x: x[1])[0]
-        else:
-            canonical2[k] = max(cand.items(), key=lambda x: x[1])[0]
-    return build_points(group2, canonical2)
+        acc["clicks"] += f["clicks"]
+        acc["impressions"] += f["impressions"]
+        acc["cost"] += f["cost"]
+        acc["conversions"] += f["conversions"]
+        acc["conv_value"] += f["conv_value"]
+    return out
 
 # -------------------- ADS HELPERS --------------------
 
 def ads_totals(start: str, end: str) -> Optional[Dict[str, Any]]:
-    if not ads_client or not ADS_CUSTOMER_ID:
+    facts = ads_store_rows(start, end)
+    if facts is None:
         return None
-    from google.ads.googleads.client import GoogleAdsClient  # type: ignore
-    service = ads_client.get_service("GoogleAdsService")
-    customer_id = ADS_CUSTOMER_ID.replace("-", "")
-    query = f"""
-        SELECT segments.date, metrics.clicks, metrics.impressions, metrics.cost_micros, metrics.average_cpc
-        FROM customer
-        WHERE segments.date BETWEEN '{start}' AND '{end}'
-    """
-    resp = service.search(customer_id=customer_id, query=query)
     clicks = imp = 0
     cost = cpc = 0.0
     days = 0
-    for row in resp:
+    # Equivalente ao antigo FROM customer: média do CPC diário
+    for row in ads_group(facts, lambda f: f["day"]).values():
         days += 1
-        clicks += int(row.metrics.clicks or 0)
-        imp += int(row.metrics.impressions or 0)
-        cost += (row.metrics.cost_micros or 0) / 1_000_000
-        cpc += ((row.metrics.average_cpc or 0) / 1_000_000)
+        clicks += row["clicks"]
+        imp += row["impressions"]
+        cost += row["cost"]
+        cpc += (row["cost"] / row["clicks"]) if row["clicks"] else 0.0
     avg_cpc = round((cpc / days) if days else (cost / clicks if clicks else 0), 2)
     return {"clicks": clicks, "impressoes": imp, "custo": round(cost, 2), "cpc": avg_cpc}
 
 
 def ads_campaign_rows(start: str, end: str) -> Optional[List[Dict[str, Any]]]:
-    if not ads_client or not ADS_CUSTOMER_ID:
+    facts = ads_store_rows(start, end)
+    if facts is None:
         return None
-    service = ads_client.get_service("GoogleAdsService")
-    customer_id = ADS_CUSTOMER_ID.replace("-", "")
-    query = f"""
-        SELECT campaign.name, metrics.clicks, metrics.impressions, metrics.cost_micros, metrics.average_cpc, metrics.conversions, metrics.conversions_value
-        FROM campaign
-        WHERE segments.date BETWEEN '{start}' AND '{end}'
-    """
-    resp = service.search(customer_id=customer_id, query=query)
     rows = []
-    for row in resp:
-        clicks = int(row.metrics.clicks or 0)
-        imp = int(row.metrics.impressions or 0)
-        cost = (row.metrics.cost_micros or 0) / 1_000_000
-        cpc = (row.metrics.average_cpc or 0) / 1_000_000
-        conv = int(row.metrics.conversions or 0)
-        revenue = float(row.metrics.conversions_value or 0)
+    for c in ads_group(facts, lambda f: f["campaign_id"]).values():
+        clicks = c["clicks"]
+        imp = c["impressions"]
+        cost = c["cost"]
+        conv = int(c["conversions"])
+        revenue = float(c["conv_value"])
         ctr = (clicks / imp) if imp else 0
         roas = (revenue / cost) if cost else 0
         rows.append({
-            "name": row.campaign.name,
+            "name": c["name"],
             "clicks": clicks,
             "impressoes": imp,
             "ctr": round(ctr, 4),
-            "cpc": round(cpc if cpc else (cost / clicks if clicks else 0), 2),
+            "cpc": round(cost / clicks if clicks else 0, 2),
             "custo": round(cost, 2),
             "conversoes": conv,
             "receita": round(revenue, 2),
@@ -729,56 +2408,27 @@ def ads_campaign_rows(start: str, end: str) -> Optional[List[Dict[str, Any]]]:
 def ads_campaigns_filtered(start: str, end: str, status: str = "enabled"):
     """
     Retorna campanhas agregadas no período de forma estável.
-    Remove campos frágeis (interactions/interaction_rate/conversions_from_interactions_rate).
+    Agrega localmente a partir do store diário (sem campos frágeis de interactions).
     Calcula taxas no Python.
     """
-    if not ads_client or not ADS_CUSTOMER_ID:
+    if not ADS_CUSTOMER_ID or not get_ads_client():
         return {"rows": [], "total": None, "start": start, "end": end, "status": status}
 
-    service = ads_client.get_service("GoogleAdsService")
-    customer_id = ADS_CUSTOMER_ID.replace("-", "")
+    # falhas da API sobem para o endpoint, que marca o payload vazio como fallback
+    facts = ads_store_rows(start, end) or []
 
-    # WHERE básico por data; aplica status 'ENABLED' só quando pedido
-    where_parts = [f"segments.date BETWEEN '{start}' AND '{end}'"]
+    # status 'ENABLED' só quando pedido
     if status == "enabled":
-        where_parts.append("campaign.status = 'ENABLED'")
-    where_clause = " AND ".join(where_parts)
-
-    # Consulta estável: só métricas universalmente suportadas
-    query = f"""
-        SELECT
-          campaign.name,
-          campaign.advertising_channel_type,
-          campaign.status,
-          campaign.primary_status,
-          metrics.clicks,
-          metrics.impressions,
-          metrics.cost_micros,
-          metrics.average_cpc,
-          metrics.conversions
-        FROM campaign
-        WHERE {where_clause}
-        ORDER BY metrics.cost_micros DESC
-        LIMIT 200
-    """
-
-    print(f"[DEBUG] GAQL ads_campaigns_filtered:\n{query}")
-
-    try:
-        resp = service.search(customer_id=customer_id, query=query)
-    except Exception as e:
-        # Se a API recusou por qualquer motivo, devolve estrutura consistente
-        print(f"[ADS] campaigns query failed: {e}")
-        return {"rows": [], "total": None, "start": start, "end": end, "status": status}
+        facts = [f for f in facts if f["status"] == "ENABLED"]
 
     rows = []
     totals = {"clicks": 0, "impressions": 0, "cost": 0.0, "conversions": 0.0}
 
-    for r in resp:
-        clicks = int(r.metrics.clicks or 0)
-        imps = int(r.metrics.impressions or 0)
-        cost = (r.metrics.cost_micros or 0) / 1_000_000
-        conv = float(r.metrics.conversions or 0)
+    for r in ads_group(facts, lambda f: f["campaign_id"]).values():
+        clicks = r["clicks"]
+        imps = r["impressions"]
+        cost = r["cost"]
+        conv = r["conversions"]
 
         # Cálculos no Python (evita campos frágeis)
         avg_cpc = (cost / clicks) if clicks > 0 else 0.0
@@ -786,20 +2436,16 @@ def ads_campaigns_filtered(start: str, end: str, status: str = "enabled"):
         cpa = (cost / conv) if conv > 0 else 0.0
 
         rows.append({
-            "name": r.campaign.name,
-            "type": (
-                r.campaign.advertising_channel_type.name
-                if hasattr(r.campaign.advertising_channel_type, "name")
-                else str(r.campaign.advertising_channel_type)
-            ),
+            "name": r["name"],
+            "type": r["type"],
             "clicks": clicks,
             "interaction_rate": 0,  # não usamos mais interactions
             "cost_total": round(cost, 2),
             "avg_cpc": round(avg_cpc, 2),
             "conv_rate": round(conv_rate, 4),
             "cost_per_conv": round(cpa, 2),
-            "status": getattr(r.campaign.status, "name", str(r.campaign.status)),
-            "primary_status": getattr(r.campaign.primary_status, "name", str(r.campaign.primary_status)),
+            "status": r["status"],
+            "primary_status": r["primary_status"],
         })
 
         totals["clicks"] += clicks
@@ -808,6 +2454,7 @@ def ads_campaigns_filtered(start: str, end: str, status: str = "enabled"):
         totals["conversions"] += conv
 
     rows.sort(key=lambda x: x["cost_total"], reverse=True)
+    rows = rows[:200]
 
     if not rows:
         return {"rows": [], "total": None, "start": start, "end": end, "status": status}
@@ -821,39 +2468,17 @@ def ads_networks_breakdown(start: str, end: str):
     Quebra por rede (Pesquisa Google, Parceiros de pesquisa, Display/YT) com shares.
     Retorna: {"nets": {...}, "totals": {...}, "shares": {...}}
     """
-    if not ads_client or not ADS_CUSTOMER_ID:
+    facts = ads_store_rows(start, end)
+    if facts is None:
         return None
 
-    service = ads_client.get_service("GoogleAdsService")
-    customer_id = ADS_CUSTOMER_ID.replace("-", "")
-
-    # Usamos FROM campaign com o segmento ad_network_type (válido segundo docs)
-    # e garantimos métricas reais no período.
-    query = f"""
-      SELECT
-        segments.ad_network_type,
-        metrics.impressions,
-        metrics.clicks,
-        metrics.cost_micros,
-        metrics.conversions,
-        metrics.conversions_value
-      FROM campaign
-      WHERE segments.date BETWEEN '{start}' AND '{end}'
-        AND metrics.impressions > 0
-    """
-
-    print(f"[DEBUG] GAQL (ads_networks_breakdown):\n{query}")
-    resp = service.search(customer_id=customer_id, query=query)
-
     nets = {
         "Google Search": {"conversions": 0.0, "cost": 0.0, "conv_value": 0.0},
         "Search partners": {"conversions": 0.0, "cost": 0.0, "conv_value": 0.0},
         "Display Network": {"conversions": 0.0, "cost": 0.0, "conv_value": 0.0},
     }
 
-    def bucket_name(net):
-        # net: enum => string
-        n = net.name if hasattr(net, "name") else str(net)
+    def bucket_name(n: str):
         if n in ("SEARCH",):
             return "Google Search"
         if n in ("SEARCH_PARTNERS",):
@@ -861,12 +2486,14 @@ def ads_networks_breakdown(start: str, end: str):
         # DISPLAY + YouTube (agrupa no "Display Network")
         return "Display Network"
 
-    for row in resp:
-        key = bucket_name(row.segments.ad_network_type)
-        cost = (row.metrics.cost_micros or 0) / 1_000_000
-        nets[key]["conversions"] += float(row.metrics.conversions or 0)
-        nets[key]["cost"] += cost
-        nets[key]["conv_value"] += float(row.metrics.conversions_value or 0)
+    # campanha x rede com impressões reais no período
+    for row in ads_group(facts, lambda f: (f["campaign_id"], f["network"])).values():
+        if row["impressions"] <= 0:
+            continue
+        key = bucket_name(row["network"])
+        nets[key]["conversions"] += row["conversions"]
+        nets[key]["cost"] += row["cost"]
+        nets[key]["conv_value"] += row["conv_value"]
 
     totals = {
         "conversions": sum(v["conversions"] for v in nets.values()),
@@ -912,7 +2539,7 @@ async def send_feedback_via_resend(subject: str, text: str, html: str, attachmen
         }
         if attachments:
             params["attachments"] = [{"filename": a["filename"], "content": a["content"]} for a in attachments]
-        r = resend.Emails.send(params)
+        r = await run_blocking("email", resend.Emails.send, params)
         return {"sent": True, "id": r.get("id")}
     except Exception as e:
         print("[RESEND] error:", e)
@@ -924,34 +2551,24 @@ async def send_feedback_via_resend(subject: str, text: str, html: str, attachmen
 
 class MonthlyReportRequest(BaseModel):
     month: str  # 'YYYY-MM'
+    force: bool = False  # ignora o relatório salvo e chama o LLM de novo
 
 def prev_month_str(month_str: str) -> str:
     y, m = [int(x) for x in month_str.split("-")]
     return f"{y-1}-12" if m == 1 else f"{y}-{str(m-1).zfill(2)}"
 
 
-def kpis_month(start: str, end: str) -> Dict[str, Any]:
-    """Receita (GA4), Reservas (GA4), Diárias (itemsPurchased), Clicks/Impressões/CPC (Ads)."""
-    receita = ga4_sum_item_revenue(start, end) or 0.0
-    try:
-        reservas = ga4_count_reservations(start, end) or 0
-    except Exception:
-        reservas = 0
-    try:
-        rows = ga4_revenue_qty_by_date(start, end) or []
-        diarias = int(round(sum((r.get("qty") or 0) for r in rows)))
-    except Exception:
-        diarias = 0
-    clicks = impressoes = 0
-    custo = cpc = 0.0
-    try:
-        ads = ads_totals(start, end) or {}
-        clicks = int(ads.get("clicks") or 0)
-        impressoes = int(ads.get("impressoes") or 0)
-        custo = float(ads.get("custo") or 0)
-        cpc = float(ads.get("cpc") or (custo / clicks if clicks else 0))
-    except Exception:
-        pass
+def kpis_month_pack(ga4: Optional[Dict[str, Any]], ads: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Monta os KPIs do relatório a partir dos totais GA4 e Ads (None → zeros)."""
+    ga4 = ga4 or {}
+    ads = ads or {}
+    receita = ga4.get("receita") or 0.0
+    reservas = ga4.get("reservas") or 0
+    diarias = int(round(ga4.get("diarias") or 0))
+    clicks = int(ads.get("clicks") or 0)
+    impressoes = int(ads.get("impressoes") or 0)
+    custo = float(ads.get("custo") or 0)
+    cpc = float(ads.get("cpc") or (custo / clicks if clicks else 0))
     return {
         "receita": round(receita, 2),
         "reservas": int(reservas),
@@ -961,62 +2578,118 @@ def kpis_month(start: str, end: str) -> Dict[str, Any]:
         "cpc": round(cpc, 2)
     }
 
-def uh_totals_month(start: str, end: str) -> Dict[str, float]:
+# The *_month helpers below are report stages: errors propagate (and None means
+# "no data source") so report_stage can use its default and flag the report as degraded.
+
+def uh_totals_month(start: str, end: str) -> Optional[Dict[str, float]]:
     """Total de receita por UH no mês."""
+    rows = ga4_revenue_by_item_per_day(start, end)
+    if rows is None:
+        return None
     out: Dict[str, float] = {}
-    try:
-        rows = ga4_revenue_by_item_per_day(start, end) or []
-        for p in rows:
-            for k, v in (p.get("values") or {}).items():
-                out[k] = (out.get(k, 0) + (v or 0))
-    except Exception:
-        pass
+    for p in rows:
+        for k, v in (p.get("values") or {}).items():
+            out[k] = (out.get(k, 0) + (v or 0))
     return {k: round(v, 2) for k, v in out.items()}
 
-def acq_totals_month(start: str, end: str) -> Dict[str, float]:
+def acq_totals_month(start: str, end: str) -> Optional[Dict[str, float]]:
     """Total de usuários por canal no mês (primeiro primary; fallback default)."""
-    res: Dict[str, float] = {}
-    try:
-        def run_dim(dim):
-            from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, RunReportRequest
-            req = RunReportRequest(
-                property=f"properties/{GA4_PROPERTY_ID}",
-                dimensions=[Dimension(name=dim)],
-                metrics=[Metric(name="users")],
-                date_ranges=[DateRange(start_date=start, end_date=end)],
-                limit=250000,
-            )
-            resp = ga4_client.run_report(req)
-            tmp = {}
-            for row in resp.rows:
-                ch = row.dimension_values[0].value or "Unassigned"
-                tmp[ch] = (tmp.get(ch, 0) + float(row.metric_values[0].value or 0))
-            return tmp
-        try:
-            res = run_dim("firstUserPrimaryChannelGroup")
-        except Exception:
-            res = run_dim("firstUserDefaultChannelGroup")
+    if not GA4_PROPERTY_ID or not get_ga4_client():
+        return None
+
+    def run_dim(dim):
+        from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, RunReportRequest
+        req = RunReportRequest(
+            property=f"properties/{GA4_PROPERTY_ID}",
+            dimensions=[Dimension(name=dim)],
+            metrics=[Metric(name="users")],
+            date_ranges=[DateRange(start_date=start, end_date=end)],
+            limit=250000,
+        )
+        resp = ga4_run_report(req)
+        tmp = {}
+        for row in resp.rows:
+            ch = row.dimension_values[0].value or "Unassigned"
+            tmp[ch] = (tmp.get(ch, 0) + float(row.metric_values[0].value or 0))
+        return tmp
+
+    try:
+        res = run_dim("firstUserPrimaryChannelGroup")
     except Exception:
-        pass
+        res = run_dim("firstUserDefaultChannelGroup")
     return {k: round(v, 2) for k, v in res.items()}
 
-def pmc_series_month(start: str, end: str) -> List[Dict[str, Any]]:
+def pmc_series_month(start: str, end: str) -> Optional[List[Dict[str, Any]]]:
     """Preço Médio por Compra por dia do mês (itemRevenue/itemsPurchased)."""
+    rows = ga4_revenue_qty_by_date(start, end)
+    if rows is None:
+        return None
+    out = []
+    for r in rows:
+        adr = (r["revenue"] / r["qty"]) if r.get("qty") else 0.0
+        out.append({"date": r["date"], "pmc": round(adr, 2)})
+    return out
+
+def networks_month(start: str, end: str) -> Optional[Dict[str, Any]]:
+    return ads_networks_breakdown(start, end)
+
+# -------------------- MONTHLY REPORT STORE --------------------
+# Generated reports are kept in the fact store keyed by (month, hash of the data sent
+# to the LLM): the LLM only runs again when the numbers behind the report change.
+# Once a report was generated after both GA4 and Ads settled the whole month, its data
+# can no longer change and it is served without touching GA4/Ads at all.
+
+def report_data_hash(payload: Dict[str, Any]) -> str:
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def report_store_get(month: str, data_hash: Optional[str] = None) -> Optional[Tuple[Dict[str, Any], float]]:
+    """(body, created_at) for month+hash, or the latest report of the month when no hash is given."""
+    conn = facts_db()
+    if conn is None:
+        return None
     try:
-        rows = ga4_revenue_qty_by_date(start, end) or []
-        out = []
-        for r in rows:
-            adr = (r["revenue"] / r["qty"]) if r.get("qty") else 0.0
-            out.append({"date": r["date"], "pmc": round(adr, 2)})
-        return out
-    except Exception:
-        return []
+        with _facts_lock:
+            if data_hash is None:
+                row = conn.execute(
+                    "SELECT body, created_at FROM monthly_reports WHERE month = ? ORDER BY created_at DESC LIMIT 1",
+                    (month,),
+                ).fetchone()
+            else:
+                row = conn.execute(
+                    "SELECT body, created_at FROM monthly_reports WHERE month = ? AND data_hash = ?",
+                    (month, data_hash),
+                ).fetchone()
+    except Exception as e:
+        print(f"[STORE] report read failed: {e}")
+        return None
+    if not row:
+        return None
+    return json.loads(row[0]), row[1]
 
-def networks_month(start: str, end: str) -> Dict[str, Any]:
+
+def report_store_put(month: str, data_hash: str, body: Dict[str, Any]):
+    conn = facts_db()
+    if conn is None:
+        return
     try:
-        return ads_networks_breakdown(start, end) or {"nets": {}, "totals": {}, "shares": {}}
-    except Exception:
-        return {"nets": {}, "totals": {}, "shares": {}}
+        with _facts_lock:
+            conn.execute(
+                "INSERT OR REPLACE INTO monthly_reports (month, data_hash, body, created_at) VALUES (?, ?, ?, ?)",
+                (month, data_hash, json.dumps(body, ensure_ascii=False), datetime.utcnow().timestamp()),
+            )
+            conn.commit()
+    except Exception as e:
+        print(f"[STORE] report write failed: {e}")
+
+
+def report_is_final(month_end: str, created_at: float) -> bool:
+    """True if the report was built when GA4 and Ads had already settled every day of the month."""
+    built_on = datetime.utcfromtimestamp(created_at).date()
+    lag = max(GA4_STORE_LAG_DAYS, ADS_STORE_LAG_DAYS)
+    return built_on - timedelta(days=lag) >= datetime.strptime(month_end, "%Y-%m-%d").date()
+
 
 def build_gpt_prompt_pt(month: str, prev_month: str, data: Dict[str, Any]) -> str:
     return f"""
@@ -1066,22 +2739,42 @@ INSTRUÇÕES OBRIGATÓRIAS:
 Retorne APENAS o JSON válido, SEM código markdown nem explicações extras.
 """
 
+GPT_SECTION_KEYS = ["resumo", "uh", "acquisition", "pmc", "networks", "final"]
+GPT_SYSTEM_PROMPT = "Você é um analista de dados brasileiro especializado em hotelaria. Responda APENAS em JSON válido com todas as 6 chaves: resumo, uh, acquisition, pmc, networks, final."
+
+
+def gpt_fallback_sections() -> Dict[str, str]:
+    sections = {k: "—" for k in GPT_SECTION_KEYS}
+    sections["resumo"] = "Análise automática indisponível no momento."
+    return sections
+
+
+def parse_gpt_sections(content: str) -> Dict[str, Any]:
+    """JSON do LLM → seções (sem cercas markdown; chaves ausentes viram "—")."""
+    # Remove markdown code blocks if present
+    if content.startswith('```json'):
+        content = content.replace('```json', '').replace('```', '').strip()
+    elif content.startswith('```'):
+        content = content.replace('```', '').strip()
+    try:
+        sections = json.loads(content)
+        # Ensure all required keys exist
+        for key in GPT_SECTION_KEYS:
+            if key not in sections:
+                sections[key] = "—"
+    except Exception as e:
+        print(f"[GPT] JSON parse failed: {e}")
+        sections = {k: "—" for k in GPT_SECTION_KEYS}
+        sections["resumo"] = content
+    return sections
+
+
 def run_gpt_sections_safe(prompt: str) -> tuple[dict, dict]:
     """
     Tenta gerar as seções via OpenAI.
     Retorno: (sections_dict, meta_dict)
     meta = {"ok": bool, "reason": "ok" | "quota_exceeded" | "no_api_key" | "error"}
     """
-    def fallback_sections():
-        return {
-            "resumo": "Análise automática indisponível no momento.",
-            "uh": "—",
-            "acquisition": "—",
-            "pmc": "—",
-            "networks": "—",
-            "final": "—"
-        }
-
     # Try Emergent LLM key first
     emergent_key = os.environ.get("EMERGENT_LLM_KEY")
     if emergent_key:
@@ -1089,184 +2782,380 @@ def run_gpt_sections_safe(prompt: str) -> tuple[dict, dict]:
             import litellm
             
             # Use litellm with emergent proxy
-            response = litellm.completion(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "Você é um analista de dados brasileiro especializado em hotelaria. Responda APENAS em JSON válido com todas as 6 chaves: resumo, uh, acquisition, pmc, networks, final."},
-                    {"role": "user", "content": prompt}
-                ],
-                api_key=emergent_key,
-                api_base="https://integrations.emergentagent.com/llm",
-                custom_llm_provider="openai",
-                temperature=0.2,
-                max_tokens=3000  # Increased for complete JSON
-            )
+            with llm_timer("emergent", "complete"):
+                response = litellm.completion(
+                    model="gpt-4o",
+                    messages=[
+                        {"role": "system", "content": GPT_SYSTEM_PROMPT},
+                        {"role": "user", "content": prompt}
+                    ],
+                    api_key=emergent_key,
+                    api_base="https://integrations.emergentagent.com/llm",
+                    custom_llm_provider="openai",
+                    temperature=0.2,
+                    max_tokens=3000  # Increased for complete JSON
+                )
             
             content = response.choices[0].message.content.strip()
-            
-            # Remove markdown code blocks if present
-            if content.startswith('```json'):
-                content = content.replace('```json', '').replace('```', '').strip()
-            elif content.startswith('```'):
-                content = content.replace('```', '').strip()
-            
-            try:
-                sections = json.loads(content)
-                # Ensure all required keys exist  
-                required_keys = ["resumo", "uh", "acquisition", "pmc", "networks", "final"]
-                for key in required_keys:
-                    if key not in sections:
-                        sections[key] = "—"
-            except Exception as e:
-                print(f"[GPT] JSON parse failed: {e}")
-                sections = {
-                    "resumo": content,
-                    "uh": "—",
-                    "acquisition": "—",
-                    "pmc": "—",
-                    "networks": "—",
-                    "final": "—"
-                }
-            return sections, {"ok": True, "reason": "ok"}
+            return parse_gpt_sections(content), {"ok": True, "reason": "ok"}
         except Exception as e:
             print(f"[GPT] Emergent key failed: {e}")
             # Continue to regular OpenAI
 
+    openai_client = get_openai_client()
     if not openai_client:
-        return fallback_sections(), {"ok": False, "reason": "no_api_key"}
+        return gpt_fallback_sections(), {"ok": False, "reason": "no_api_key"}
 
     try:
         model = os.environ.get("OPENAI_MODEL", "gpt-4o")  # Changed from gpt-5 to gpt-4o
-        resp = openai_client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "Você é um analista de dados brasileiro especializado em hotelaria. Responda APENAS em JSON válido com todas as 6 chaves: resumo, uh, acquisition, pmc, networks, final."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.2,
-            max_tokens=3000  # Increased for complete JSON
-        )
+        with llm_timer("openai", "complete"):
+            resp = openai_client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": GPT_SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.2,
+                max_tokens=3000  # Increased for complete JSON
+            )
         content = (resp.choices[0].message.content or "").strip()
-        
-        # Remove markdown code blocks if present
-        if content.startswith('```json'):
-            content = content.replace('```json', '').replace('```', '').strip()
-        elif content.startswith('```'):
-            content = content.replace('```', '').strip()
-        
-        try:
-            sections = json.loads(content)
-            # Ensure all required keys exist  
-            required_keys = ["resumo", "uh", "acquisition", "pmc", "networks", "final"]
-            for key in required_keys:
-                if key not in sections:
-                    sections[key] = "—"
-        except Exception as e:
-            print(f"[GPT] JSON parse failed: {e}")
-            sections = {
-                "resumo": content,
-                "uh": "—",
-                "acquisition": "—",
-                "pmc": "—",
-                "networks": "—",
-                "final": "—"
-            }
-        return sections, {"ok": True, "reason": "ok"}
+        return parse_gpt_sections(content), {"ok": True, "reason": "ok"}
     except Exception as e:
         msg = str(e).lower()
         if "429" in msg or "quota" in msg:
-            return fallback_sections(), {"ok": False, "reason": "quota_exceeded"}
-        return fallback_sections(), {"ok": False, "reason": "error"}
+            return gpt_fallback_sections(), {"ok": False, "reason": "quota_exceeded"}
+        return gpt_fallback_sections(), {"ok": False, "reason": "error"}
+
+
+def stream_gpt_text(prompt: str, stop: threading.Event):
+    """Blocking generator of LLM text deltas (same model/prompt as run_gpt_sections_safe).
+
+    Tries the Emergent key first and falls back to OpenAI only if nothing was produced yet.
+    Raises RuntimeError("no_api_key") when no provider is configured.
+    """
+    messages = [
+        {"role": "system", "content": GPT_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+    emergent_key = os.environ.get("EMERGENT_LLM_KEY")
+    if emergent_key:
+        produced = False
+        try:
+            import litellm
+            with llm_timer("emergent", "stream"):
+                response = litellm.completion(
+                    model="gpt-4o",
+                    messages=messages,
+                    api_key=emergent_key,
+                    api_base="https://integrations.emergentagent.com/llm",
+                    custom_llm_provider="openai",
+                    temperature=0.2,
+                    max_tokens=3000,
+                    stream=True,
+                )
+                for chunk in response:
+                    if stop.is_set():
+                        return
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        produced = True
+                        yield delta
+            return
+        except Exception as e:
+            if produced:
+                raise
+            print(f"[GPT] Emergent key failed: {e}")
+
+    openai_client = get_openai_client()
+    if not openai_client:
+        raise RuntimeError("no_api_key")
+    with llm_timer("openai", "stream"):
+        stream = openai_client.chat.completions.create(
+            model=os.environ.get("OPENAI_MODEL", "gpt-4o"),
+            messages=messages,
+            temperature=0.2,
+            max_tokens=3000,
+            stream=True,
+        )
+        for chunk in stream:
+            if stop.is_set():
+                return
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                yield delta
+
+
+class GptSectionScanner:
+    """Picks complete `"key": "value"` sections out of a partially streamed JSON object."""
+
+    def __init__(self):
+        self.buf = ""
+        self.done: Dict[str, str] = {}
+        self._decoder = json.JSONDecoder()
+        self._key_re = re.compile(r'"(' + "|".join(GPT_SECTION_KEYS) + r')"\s*:\s*"')
+
+    def feed(self, text: str) -> List[Tuple[str, str]]:
+        self.buf += text
+        found = []
+        for m in self._key_re.finditer(self.buf):
+            key = m.group(1)
+            if key in self.done:
+                continue
+            try:
+                value, _ = self._decoder.raw_decode(self.buf, m.end() - 1)
+            except ValueError:
+                break  # value still streaming
+            self.done[key] = value
+            found.append((key, value))
+        return found
+
+
+async def iterate_blocking(pool: str, gen_fn, *args):
+    """Async iterator over a blocking generator that runs in the named executor pool."""
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def pump():
+        try:
+            for item in gen_fn(*args, stop):
+                loop.call_soon_threadsafe(queue.put_nowait, ("item", item))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, ("error", e))
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, ("end", None))
+
+    asyncio.ensure_future(run_blocking(pool, pump))
+    try:
+        while True:
+            kind, value = await queue.get()
+            if kind == "item":
+                yield value
+            elif kind == "error":
+                raise value
+            else:
+                break
+    finally:
+        stop.set()  # consumer went away (client disconnected) → let the thread wind down
+
+
+# -------------------- PREFETCH --------------------
+# Background refresher: records which (endpoint, params) pairs are requested the
+# most and refreshes the top ones shortly before their soft TTL runs out, within a
+# per-cycle budget. On every UTC day rollover the ranking is reset (yesterday's
+# relative ranges are no longer refreshed) and today's usual ranges -- last 7/30
+# days, current month, previous month -- are warmed so morning loads hit the cache.
+PREFETCH_ENABLED = os.environ.get("PREFETCH_ENABLED", "1") == "1"
+PREFETCH_INTERVAL_SECONDS = int(os.environ.get("PREFETCH_INTERVAL_SECONDS", "60"))
+PREFETCH_BUDGET = int(os.environ.get("PREFETCH_BUDGET", "6"))  # refreshes per cycle
+PREFETCH_TOP_N = int(os.environ.get("PREFETCH_TOP_N", "20"))
+PREFETCH_LEAD_SECONDS = int(os.environ.get("PREFETCH_LEAD_SECONDS", "120"))
+PREFETCH_MAX_TRACKED = 500
+PREFETCH_DECAY = 0.98  # per cycle; ~50% after 35 cycles
+
+def prefetch_deferred(endpoint: str) -> bool:
+    """GA4-backed prefetches wait while the property is short on quota (or there is no
+    background GA4 slot at all); user requests don't."""
+    policy = ENDPOINT_CACHE_POLICIES.get(endpoint)
+    return bool(policy and "ga4" in policy.sources and (not GA4_BACKGROUND_SLOTS or ga4_quota.low()))
+
+
+def prefetch_seed_targets(today: date) -> List[Tuple[str, Dict[str, Any]]]:
+    """Endpoints/params the dashboard asks for first thing every day."""
+    cur_month = f"{today.year}-{str(today.month).zfill(2)}"
+    prev_month = prev_month_str(cur_month)
+    # default dashboard view: last 7 days (+ previous 7 for deltas), then 30 days and months
+    ranges = [
+        ((today - timedelta(days=6)).isoformat(), today.isoformat()),
+        ((today - timedelta(days=13)).isoformat(), (today - timedelta(days=7)).isoformat()),
+        ((today - timedelta(days=29)).isoformat(), today.isoformat()),
+        month_bounds(cur_month),
+        month_bounds(prev_month),
+    ]
+    targets: List[Tuple[str, Dict[str, Any]]] = []
+    for start, end in ranges:
+        targets.append(("kpis", {"start": start, "end": end}))
+        targets.append(("acq", {"metric": "users", "start": start, "end": end}))
+        targets.append(("revuh", {"start": start, "end": end}))
+        targets.append(("adr", {"start": start, "end": end}))
+    targets.append(("dials", {"start": None, "end": None, "period": "last30"}))
+    for month in [None, cur_month, prev_month]:
+        targets.append(("ads-campaigns", {"status": "all", "period": "last30", "month": month}))
+        targets.append(("ads-networks", {"period": "last30", "month": month}))
+    return targets
+
+
+class Prefetcher:
+    def __init__(self):
+        # cache key -> {"endpoint", "params", "end", "score"}
+        self.tracked: Dict[str, Dict[str, Any]] = {}
+        self.seeds: List[Tuple[str, Dict[str, Any]]] = []
+        self.day: Optional[date] = None
+
+    def record(self, endpoint: str, key: str, params: Dict[str, Any], end: str):
+        """Called by each prefetchable endpoint; prefetch calls themselves are not counted."""
+        if request_priority.get() == "background":
+            return
+        item = self.tracked.get(key)
+        if item is None:
+            if len(self.tracked) >= PREFETCH_MAX_TRACKED:
+                coldest = min(self.tracked, key=lambda k: self.tracked[k]["score"])
+                del self.tracked[coldest]
+            item = self.tracked[key] = {"endpoint": endpoint, "params": dict(params), "end": end, "score": 0.0}
+        item["score"] += 1.0
+
+    def _rollover(self):
+        today = datetime.utcnow().date()
+        if today == self.day:
+            return
+        self.day = today
+        self.tracked.clear()
+        self.seeds = prefetch_seed_targets(today)
+
+    async def _call(self, endpoint: str, params: Dict[str, Any], refresh: bool):
+        handler = PREFETCH_ENDPOINTS.get(endpoint)
+        if handler is None:
+            return
+        try:
+            await handler(**params, refresh=1 if refresh else 0)
+        except Exception as e:
+            print(f"[PREFETCH] {endpoint} {params} failed: {e}")
+
+    async def run_cycle(self) -> int:
+        """One pass: warm pending seeds, then refresh the hottest keys close to expiry."""
+        self._rollover()
+        budget = PREFETCH_BUDGET
+        token = request_priority.set("background")
+        deferred: List[Tuple[str, Dict[str, Any]]] = []
+        try:
+            while self.seeds and budget > 0:
+                endpoint, params = self.seeds.pop(0)
+                if prefetch_deferred(endpoint):
+                    deferred.append((endpoint, params))
+                    continue
+                await self._call(endpoint, params, refresh=False)  # SWR: only computes if missing/stale
+                budget -= 1
+            self.seeds[:0] = deferred  # retried next cycle
+            ranked = sorted(self.tracked.items(), key=lambda kv: kv[1]["score"], reverse=True)[:PREFETCH_TOP_N]
+            for key, item in ranked:
+                if budget <= 0:
+                    break
+                if prefetch_deferred(item["endpoint"]):
+                    deferred.append((item["endpoint"], item["params"]))
+                    continue
+                policy = cache_policy(item["endpoint"], item["end"])
+                # another worker may have refreshed it already (shared tier) or be refreshing it now
+                hit = await cache.freshest(key, policy.soft_ttl - PREFETCH_LEAD_SECONDS)
+                if hit is not None and hit[1] < policy.soft_ttl - PREFETCH_LEAD_SECONDS:
+                    continue
+                if not await cache.claim(f"prefetch:{key}", PREFETCH_INTERVAL_SECONDS):
+                    continue
+                await self._call(item["endpoint"], item["params"], refresh=True)
+                budget -= 1
+            for item in self.tracked.values():
+                item["score"] *= PREFETCH_DECAY
+        finally:
+            request_priority.reset(token)
+        if deferred:
+            left = ga4_quota.remaining()
+            print(f"[PREFETCH] {len(deferred)} GA4 targets deferred, quota low "
+                  f"(hour {left['tokens_per_hour']}, day {left['tokens_per_day']})")
+        return PREFETCH_BUDGET - budget
+
+
+prefetcher = Prefetcher()
 
 
 # -------------------- ENDPOINTS --------------------
 @app.get("/api/kpis", response_model=KPIResponse)
-async def get_kpis(start: str = Query(...), end: str = Query(...), refresh: Optional[int] = 0):
+async def get_kpis(start: str = Query(...), end: str = Query(...), refresh: Optional[int] = 0, request: Request = None):
     s, e = parse_dates(start, end)
     key = f"kpis-{start}-{end}"
-    if not refresh:
-        cached = cache.get(key, ttl_seconds=int(os.environ.get("GA4_CACHE_TTL_SECONDS", "900")))
-        if cached:
-            return cached
-    data = mock_kpis(s, e)
-    try:
-        r = ga4_sum_item_revenue(start, end)
-        if r is not None:
-            data["receita"] = r
-    except Exception as e:
-        print(f"[GA4] kpis revenue failed: {e}")
-    try:
-        reservas = ga4_count_reservations(start, end)
-        if reservas is not None:
-            data["reservas"] = reservas
-    except Exception as e:
-        print(f"[GA4] kpis reservas failed: {e}")
-    try:
-        ads = ads_totals(start, end)
-        if ads is not None:
+    prefetcher.record("kpis", key, {"start": start, "end": end}, end)
+    async def compute():
+        data = mock_kpis(s, e)
+        # GA4 (one batched RPC for receita + reservas) and Ads totals run concurrently
+        ga4, ads = await asyncio.gather(
+            ga4_call(ga4_kpi_totals, start, end),
+            ads_call(ads_totals, start, end),
+            return_exceptions=True,
+        )
+        if isinstance(ga4, Exception):
+            print(f"[GA4] kpis revenue/reservas failed: {ga4}")
+            note_fallback("ga4")
+        elif ga4 is not None:
+            for k in ("receita", "reservas"):
+                if ga4[k] is None:
+                    note_fallback(f"ga4-{k}")  # this metric keeps its mock value
+                else:
+                    data[k] = ga4[k]
+        else:
+            note_fallback("ga4")
+        if isinstance(ads, Exception):
+            print(f"[ADS] kpis ads failed: {ads}")
+            note_fallback("ads")
+        elif ads is not None:
             data.update(ads)
-    except Exception as e:
-        print(f"[ADS] kpis ads failed: {e}")
-    cache.set(key, data)
-    return data
+        else:
+            note_fallback("ads")
+        return data
+    return await cached_response(key, cache_policy("kpis", end), compute, KPIResponse, refresh=bool(refresh), request=request)
 
 
 @app.get("/api/acquisition-by-channel", response_model=TimeSeriesResponse)
-async def acquisition_by_channel(metric: str = Query("users"), start: str = Query(...), end: str = Query(...), refresh: Optional[int] = 0):
+async def acquisition_by_channel(metric: str = Query("users"), start: str = Query(...), end: str = Query(...), refresh: Optional[int] = 0, request: Request = None):
     # Always be resilient: any exception -> mock, never 500
     try:
         s, e = parse_dates(start, end)
         key = f"acq-{metric}-{start}-{end}"
-        if not refresh:
-            cached = cache.get(key, ttl_seconds=15 * 60)
-            if cached:
-                return cached
-
-        def run_with_dim(dim_name: str) -> Optional[List[Dict[str, Any]]]:
-            from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, RunReportRequest
-            req = RunReportRequest(
-                property=f"properties/{GA4_PROPERTY_ID}",
-                dimensions=[Dimension(name=dim_name), Dimension(name="date")],
-                metrics=[Metric(name="users")],
-                date_ranges=[DateRange(start_date=start, end_date=end)],
-            )
-            resp = ga4_client.run_report(req)
-            bucket: Dict[str, Dict[str, Any]] = {}
-            for row in resp.rows:
-                ch = row.dimension_values[0].value or "Unassigned"
-                d = row.dimension_values[1].value  # YYYYMMDD
-                v = float(row.metric_values[0].value or 0)
-                bucket.setdefault(d, {})[ch] = v
-            ordered: List[Dict[str, Any]] = []
-            for dt in daterange(s, e):
-                key_dt = dt.strftime("%Y%m%d")
-                values = bucket.get(key_dt, {})
-                ordered.append({"date": fmt_ddmmyy(dt), "values": values})
-            return ordered
-
-        points: Optional[List[Dict[str, Any]]] = None
-        if ga4_client and GA4_PROPERTY_ID:
-            try:
-                # Try primary channel group first
-                points = run_with_dim("firstUserPrimaryChannelGroup")
-            except Exception as e:
-                print(f"[GA4] primaryChannelGroup failed: {e}")
-                points = None
-            if points is None:
+        prefetcher.record("acq", key, {"metric": metric, "start": start, "end": end}, end)
+        async def compute():
+            async def run_with_dim(dim_name: str) -> Optional[List[Dict[str, Any]]]:
+                from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, RunReportRequest
+                req = RunReportRequest(
+                    property=f"properties/{GA4_PROPERTY_ID}",
+                    dimensions=[Dimension(name=dim_name), Dimension(name="date")],
+                    metrics=[Metric(name="users")],
+                    date_ranges=[DateRange(start_date=start, end_date=end)],
+                )
+                resp = await ga4_run_report_async(req)
+                bucket: Dict[str, Dict[str, Any]] = {}
+                for row in resp.rows:
+                    ch = row.dimension_values[0].value or "Unassigned"
+                    d = row.dimension_values[1].value  # YYYYMMDD
+                    v = float(row.metric_values[0].value or 0)
+                    bucket.setdefault(d, {})[ch] = v
+                ordered: List[Dict[str, Any]] = []
+                for dt in daterange(s, e):
+                    key_dt = dt.strftime("%Y%m%d")
+                    values = bucket.get(key_dt, {})
+                    ordered.append({"date": fmt_ddmmyy(dt), "values": values})
+                return ordered
+
+            points: Optional[List[Dict[str, Any]]] = None
+            if GA4_PROPERTY_ID and get_ga4_client():
                 try:
-                    # Fallback to default channel grouping (universally supported)
-                    points = run_with_dim("firstUserDefaultChannelGroup")
-                except Exception as e:
-                    print(f"[GA4] defaultChannelGroup failed: {e}")
+                    # Try primary channel group first
+                    points = await run_with_dim("firstUserPrimaryChannelGroup")
+                except Exception as err:
+                    print(f"[GA4] primaryChannelGroup failed: {err}")
                     points = None
-        # Final fallback to mock (never 500)
-        if points is None:
-            raw = mock_acquisition_timeseries(metric, s, e)
-            points = [{"date": fmt_ddmmyy(datetime.strptime(p["date"], "%Y-%m-%d")), "values": p["values"]} for p in raw]
+                if points is None:
+                    try:
+                        # Fallback to default channel grouping (universally supported)
+                        points = await run_with_dim("firstUserDefaultChannelGroup")
+                    except Exception as err:
+                        print(f"[GA4] defaultChannelGroup failed: {err}")
+                        points = None
+            # Final fallback to mock (never 500)
+            if points is None:
+                note_fallback("ga4")
+                raw = mock_acquisition_timeseries(metric, s, e)
+                points = [{"date": fmt_ddmmyy(datetime.strptime(p["date"], "%Y-%m-%d")), "values": p["values"]} for p in raw]
 
-        payload = {"metric": metric, "points": points}
-        cache.set(key, payload)
-        return payload
+            payload = {"metric": metric, "points": points}
+            return payload
+        return await cached_response(key, cache_policy("acq", end), compute, TimeSeriesResponse, refresh=bool(refresh), request=request)
     except Exception as e:
         print(f"[ACQ] endpoint fatal error -> using mock: {e}")
         # last resort: 7-day mock using provided dates (if parse failed, fallback around 'today')
@@ -1282,7 +3171,7 @@ async def acquisition_by_channel(metric: str = Query("users"), start: str = Quer
 
 
 @app.get("/api/revenue-by-uh", response_model=RevenueByUHResponse)
-async def revenue_by_uh(start: str = Query(...), end: str = Query(...), refresh: Optional[int] = 0):
+async def revenue_by_uh(start: str = Query(...), end: str = Query(...), refresh: Optional[int] = 0, request: Request = None):
     # Validate dates upfront (invalid → 422)
     try:
         parse_dates(start, end)
@@ -1291,99 +3180,93 @@ async def revenue_by_uh(start: str = Query(...), end: str = Query(...), refresh:
 
     # No mock fallback here per request; if GA4 not available, return empty series
     key = f"revuh-item-{start}-{end}"
-    if not refresh:
-        cached = cache.get(key, ttl_seconds=15 * 60)
-        if cached:
-            return cached
-    points: List[Dict[str, Any]] = []
-    try:
-        result = ga4_revenue_by_item_per_day(start, end)
-        if result is not None:
-            points = result
-    except Exception as e:
-        print(f"[GA4] revenue-by-uh failed: {e}")
-    payload = {"points": points}
-    cache.set(key, payload)
-    return payload
+    prefetcher.record("revuh", key, {"start": start, "end": end}, end)
+    async def compute():
+        points: List[Dict[str, Any]] = []
+        try:
+            result = await ga4_call(ga4_revenue_by_item_per_day, start, end)
+            if result is not None:
+                points = result
+            else:
+                note_fallback("ga4")
+        except Exception as e:
+            print(f"[GA4] revenue-by-uh failed: {e}")
+            note_fallback("ga4")
+        payload = {"points": points}
+        return payload
+    return await cached_response(key, cache_policy("revuh", end), compute, RevenueByUHResponse, refresh=bool(refresh), request=request)
 
 
 @app.get("/api/sales-uh-stacked", response_model=StackedBarsResponse)
-async def sales_uh_stacked(start: str = Query(...), end: str = Query(...), refresh: Optional[int] = 0):
+async def sales_uh_stacked(start: str = Query(...), end: str = Query(...), refresh: Optional[int] = 0, request: Request = None):
     s, e = parse_dates(start, end)
     key = f"salesuh-{start}-{end}"
-    if not refresh:
-        cached = cache.get(key, ttl_seconds=15 * 60)
-        if cached:
-            return cached
-    # keep mock until real UH stack source exists (12 months density)
-    months = ["Jan","Fev","Mar","Abr","Mai","Jun","Jul","Ago","Set","Out","Nov","Dez"]
-    from random import randint
-    payload = {"series_labels": UH_TYPES, "points": [{"label": m, "values": {t: randint(60,260) for t in UH_TYPES}} for m in months]}
-    cache.set(key, payload)
-    return payload
+    async def compute():
+        # keep mock until real UH stack source exists (12 months density)
+        months = ["Jan","Fev","Mar","Abr","Mai","Jun","Jul","Ago","Set","Out","Nov","Dez"]
+        from random import randint
+        payload = {"series_labels": UH_TYPES, "points": [{"label": m, "values": {t: randint(60,260) for t in UH_TYPES}} for m in months]}
+        return payload
+    return await cached_response(key, cache_policy("salesuh", end), compute, StackedBarsResponse, refresh=bool(refresh), request=request)
 
 
 @app.get("/api/campaign-conversion-heatmap", response_model=HeatmapResponse)
-async def campaign_conversion_heatmap(start: str = Query(...), end: str = Query(...), refresh: Optional[int] = 0):
+async def campaign_conversion_heatmap(start: str = Query(...), end: str = Query(...), refresh: Optional[int] = 0, request: Request = None):
     # keep mock heatmap for now
     s, e = parse_dates(start, end)
     key = f"heatmap-{start}-{end}"
-    if not refresh:
-        cached = cache.get(key, ttl_seconds=15 * 60)
-        if cached:
-            return cached
-    cells = []
-    for day in range(7):
-        for hour in range(24):
-            base = 2 + (6 - abs(12 - hour)) * 0.8
-            val = max(0, random.gauss(mu=base, sigma=1.4))
-            cells.append({"day": day, "hour": hour, "value": round(val, 2)})
-    payload = {"cells": cells}
-    cache.set(key, payload)
-    return payload
+    async def compute():
+        cells = []
+        for day in range(7):
+            for hour in range(24):
+                base = 2 + (6 - abs(12 - hour)) * 0.8
+                val = max(0, random.gauss(mu=base, sigma=1.4))
+                cells.append({"day": day, "hour": hour, "value": round(val, 2)})
+        payload = {"cells": cells}
+        return payload
+    return await cached_response(key, cache_policy("heatmap", end), compute, HeatmapResponse, refresh=bool(refresh), request=request)
 
 
 @app.get("/api/performance-table", response_model=PerformanceTableResponse)
-async def performance_table(start: str = Query(...), end: str = Query(...), refresh: Optional[int] = 0):
+async def performance_table(start: str = Query(...), end: str = Query(...), refresh: Optional[int] = 0, request: Request = None):
     key = f"table-{start}-{end}"
-    if not refresh:
-        cached = cache.get(key, ttl_seconds=15 * 60)
-        if cached:
-            return cached
-    rows = None
-    try:
-        rows = ads_campaign_rows(start, end)
-    except Exception as e:
-        print(f"[ADS] table failed: {e}")
+    async def compute():
         rows = None
-    if rows is None:
-        # basic mock if ads unavailable
-        rows = []
-    payload = {"rows": rows}
-    cache.set(key, payload)
-    return payload
+        try:
+            rows = await ads_call(ads_campaign_rows, start, end)
+        except Exception as e:
+            print(f"[ADS] table failed: {e}")
+            rows = None
+        if rows is None:
+            # basic mock if ads unavailable
+            note_fallback("ads")
+            rows = []
+        payload = {"rows": rows}
+        return payload
+    return await cached_response(key, cache_policy("table", end), compute, PerformanceTableResponse, refresh=bool(refresh), request=request)
 
 
 @app.get("/api/adr", response_model=ADRResponse)
-async def adr_by_stay_date(start: str = Query(...), end: str = Query(...), refresh: Optional[int] = 0):
+async def adr_by_stay_date(start: str = Query(...), end: str = Query(...), refresh: Optional[int] = 0, request: Request = None):
     s, e = parse_dates(start, end)
     key = f"adr-{start}-{end}"
-    if not refresh:
-        cached = cache.get(key, ttl_seconds=15 * 60)
-        if cached:
-            return cached
-    points: List[Dict[str, Any]] = []
-    try:
-        rows = ga4_revenue_qty_by_date(start, end)
-        if rows is not None:
-            for r in rows:
-                adr = (r["revenue"] / r["qty"]) if r.get("qty") else 0.0
-                points.append({"date": r["date"], "adr": round(adr, 2)})
-    except Exception as e:
-        print(f"[GA4] ADR endpoint failed: {e}")
-    payload = {"points": points}
-    cache.set(key, payload)
-    return payload
+    prefetcher.record("adr", key, {"start": start, "end": end}, end)
+    async def compute():
+        points: List[Dict[str, Any]] = []
+        try:
+            rows = await ga4_call(ga4_revenue_qty_by_date, start, end)
+            if rows is not None:
+                for r in rows:
+                    adr = (r["revenue"] / r["qty"]) if r.get("qty") else 0.0
+                    points.append({"date": r["date"], "adr": round(adr, 2)})
+            else:
+                note_fallback("ga4")
+        except Exception as e:
+            print(f"[GA4] ADR endpoint failed: {e}")
+            note_fallback("ga4")
+        payload = {"points": points}
+        return payload
+    return await cached_response(key, cache_policy("adr", end), compute, ADRResponse, refresh=bool(refresh), request=request)
 
 
 @app.get("/api/marketing-dials", response_model=DialsResponse)
@@ -1391,7 +3274,8 @@ async def marketing_dials(
     start: str = Query(None),
     end: str = Query(None),
     period: str = Query("last30"),
-    refresh: Optional[int] = 0
+    refresh: Optional[int] = 0,
+    request: Request = None,
 ):
     # Se não vier start/end → aplica período padrão (últimos 30 dias)
     if not start or not end:
@@ -1410,33 +3294,38 @@ async def marketing_dials(
     prev_end = prev[1].strftime("%Y-%m-%d")
 
     key = f"dials-{start}-{end}"
-    if not refresh:
-        cached = cache.get(key, ttl_seconds=10 * 60)
-        if cached:
-            return cached
-
-    def pack(val: float, prev_val: float) -> Dict[str, float]:
-        delta = 0.0
-        if prev_val == 0:
-            delta = 100.0 if val > 0 else 0.0
-        else:
-            delta = (val - prev_val) / prev_val * 100.0
-        return {"value": round(val, 4), "prev": round(prev_val, 4), "delta_pct": round(delta, 1)}
+    prefetcher.record("dials", key, {"start": start, "end": end, "period": period}, end)
+    async def compute():
+        def pack(val: float, prev_val: float) -> Dict[str, float]:
+            delta = 0.0
+            if prev_val == 0:
+                delta = 100.0 if val > 0 else 0.0
+            else:
+                delta = (val - prev_val) / prev_val * 100.0
+            return {"value": round(val, 4), "prev": round(prev_val, 4), "delta_pct": round(delta, 1)}
+
+        cr_pack = {"value": 0.0, "prev": 0.0, "delta_pct": 0.0}
+        roas_pack = {"value": 0.0, "prev": 0.0, "delta_pct": 0.0}
 
-    cr_pack = {"value": 0.0, "prev": 0.0, "delta_pct": 0.0}
-    roas_pack = {"value": 0.0, "prev": 0.0, "delta_pct": 0.0}
-
-    try:
-        cur = ads_enabled_campaign_totals(start, end) or {}
-        prv = ads_enabled_campaign_totals(prev_start, prev_end) or {}
-        cr_pack = pack(cur.get("cr", 0.0), prv.get("cr", 0.0))
-        roas_pack = pack(cur.get("roas", 0.0), prv.get("roas", 0.0))
-    except Exception as e:
-        print(f"[ADS] dials failed: {e}")
+        try:
+            # período atual e anterior em paralelo
+            cur, prv = await asyncio.gather(
+                ads_call(ads_enabled_campaign_totals, start, end),
+                ads_call(ads_enabled_campaign_totals, prev_start, prev_end),
+            )
+            if cur is None or prv is None:
+                note_fallback("ads")
+            cur = cur or {}
+            prv = prv or {}
+            cr_pack = pack(cur.get("cr", 0.0), prv.get("cr", 0.0))
+            roas_pack = pack(cur.get("roas", 0.0), prv.get("roas", 0.0))
+        except Exception as e:
+            print(f"[ADS] dials failed: {e}")
+            note_fallback("ads")
 
-    payload = {"cr": cr_pack, "roas": roas_pack}
-    cache.set(key, payload)
-    return payload
+        payload = {"cr": cr_pack, "roas": roas_pack}
+        return payload
+    return await cached_response(key, cache_policy("dials", end), compute, DialsResponse, refresh=bool(refresh), request=request)
 
 
 # -------------------------------------------------------------------
@@ -1461,63 +3350,80 @@ def month_bounds(month_str: str):
         return None, None
 
 
+def resolve_period_range(period: str, month: Optional[str]) -> Tuple[str, str]:
+    """Intervalo (start, end) de `month` (YYYY-MM) ou, por padrão, dos últimos 30 dias até ontem (UTC)."""
+    if month:
+        start, end = month_bounds(month)
+        if not start:
+            raise HTTPException(status_code=422, detail="month deve estar no formato YYYY-MM")
+        return start, end
+    # "last30" e qualquer outro valor caem no mesmo padrão
+    today_utc = datetime.now(timezone.utc).date()
+    end_dt = today_utc - timedelta(days=1)
+    start_dt = end_dt - timedelta(days=29)
+    return start_dt.strftime("%Y-%m-%d"), end_dt.strftime("%Y-%m-%d")
+
+
+async def ads_campaigns_cached(start: str, end: str, status: str, refresh: bool = False,
+                               request: Optional[Request] = None) -> Response:
+    cache_key = f"ads-campaigns-{status}-{start}-{end}"
+
+    async def compute():
+        payload = {
+            "rows": [],
+            "total": None,
+            "start": start,
+            "end": end,
+            "status": status,
+        }
+
+        try:
+            res = await ads_call(ads_campaigns_filtered, start, end, status)
+            if res:
+                payload.update(res)
+            elif res is None:
+                note_fallback("ads")
+        except Exception as e:
+            print(f"[ADS] /api/ads-campaigns failed: {e}")
+            note_fallback("ads")
+
+        return payload
+    return await cached_response(cache_key, cache_policy("ads-campaigns", end), compute, refresh=refresh, request=request)
+
+
 @app.get("/api/ads-campaigns")
 async def ads_campaigns(
     status: str = Query("enabled"),
     period: str = Query("last30"),
     month: Optional[str] = None,
     refresh: Optional[int] = 0,
+    request: Request = None,
 ):
     """Endpoint para listar campanhas do Google Ads com filtros de período e status."""
 
-    cache_key = f"ads-campaigns-{status}-{period}-{month or ''}"
-    if not refresh:
-        cached = cache.get(cache_key, ttl_seconds=10 * 60)
-        if cached:
-            return cached
+    start, end = resolve_period_range(period, month)
+    prefetcher.record("ads-campaigns", f"ads-campaigns-{status}-{start}-{end}", {"status": status, "period": period, "month": month}, end)
+    return await ads_campaigns_cached(start, end, status, refresh=bool(refresh), request=request)
 
-    # Resolve intervalo
-    start, end = None, None
-    if month:
-        start, end = month_bounds(month)
-        if not start:
-            raise HTTPException(
-                status_code=422,
-                detail="month deve estar no formato YYYY-MM"
-            )
-    elif period == "last30":
-        from datetime import timezone
-        today_utc = datetime.now(timezone.utc).date()
-        end_dt = today_utc - timedelta(days=1)
-        start_dt = end_dt - timedelta(days=29)
-        start = start_dt.strftime("%Y-%m-%d")
-        end = end_dt.strftime("%Y-%m-%d")
-    else:
-        from datetime import timezone
-        today_utc = datetime.now(timezone.utc).date()
-        end_dt = today_utc - timedelta(days=1)
-        start_dt = end_dt - timedelta(days=29)
-        start = start_dt.strftime("%Y-%m-%d")
-        end = end_dt.strftime("%Y-%m-%d")
-
-
-    payload = {
-        "rows": [],
-        "total": None,
-        "start": start,
-        "end": end,
-        "status": status,
-    }
 
-    try:
-        res = ads_campaigns_filtered(start, end, status)
-        if res:
-            payload.update(res)
-    except Exception as e:
-        print(f"[ADS] /api/ads-campaigns failed: {e}")
+async def ads_networks_cached(start: str, end: str, refresh: bool = False,
+                              request: Optional[Request] = None) -> Response:
+    cache_key = f"ads-networks-{start}-{end}"
+
+    async def compute():
+        payload = {"start": start, "end": end, "rows": []}
+        try:
+            res = await ads_call(ads_networks_breakdown, start, end)
+            if res:
+                payload.update(res)
+            elif res is None:
+                note_fallback("ads")
+        except Exception as e:
+            print(f"[ADS] /api/ads-networks failed: {e}")
+            note_fallback("ads")
 
-    cache.set(cache_key, payload)
-    return payload
+        return payload
+    return await cached_response(cache_key, cache_policy("ads-networks", end), compute, refresh=refresh, request=request)
 
 
 @app.get("/api/ads-networks")
@@ -1525,45 +3431,98 @@ async def ads_networks(
     period: str = Query("last30"),
     month: Optional[str] = None,
     refresh: Optional[int] = 0,
+    request: Request = None,
 ):
-    cache_key = f"ads-networks-{period}-{month or ''}"
-    if not refresh:
-        cached = cache.get(cache_key, ttl_seconds=10 * 60)
-        if cached:
-            return cached
-
-    # Resolve intervalo
-    start, end = None, None
-    if month:
-        start, end = month_bounds(month)
-        if not start:
-            raise HTTPException(status_code=422, detail="month deve estar no formato YYYY-MM")
-    elif period == "last30":
-        from datetime import timezone
-        today_utc = datetime.now(timezone.utc).date()
-        end_dt = today_utc - timedelta(days=1)
-        start_dt = end_dt - timedelta(days=29)
-        start = start_dt.strftime("%Y-%m-%d")
-        end = end_dt.strftime("%Y-%m-%d")
-    else:
-        from datetime import timezone
-        today_utc = datetime.now(timezone.utc).date()
-        end_dt = today_utc - timedelta(days=1)
-        start_dt = end_dt - timedelta(days=29)
-        start = start_dt.strftime("%Y-%m-%d")
-        end = end_dt.strftime("%Y-%m-%d")
+    start, end = resolve_period_range(period, month)
+    prefetcher.record("ads-networks", f"ads-networks-{start}-{end}", {"period": period, "month": month}, end)
+    return await ads_networks_cached(start, end, refresh=bool(refresh), request=request)
+
+
+# -------------------- DASHBOARD (composite) --------------------
+# One request for a whole view: every requested widget runs concurrently through the
+# same cached endpoint code (so GA4/Ads fetches are shared via the day stores and
+# single-flight cache), and their pre-serialized bodies are spliced into one response
+# with per-widget status and timing. `compare` lists widgets also wanted for the
+# previous period of the same length (the frontend's comparison deltas).
+
+DASHBOARD_WIDGETS = {
+    "kpis": lambda s, e, r: get_kpis(start=s, end=e, refresh=r),
+    "acq": lambda s, e, r: acquisition_by_channel(metric="users", start=s, end=e, refresh=r),
+    "revuh": lambda s, e, r: revenue_by_uh(start=s, end=e, refresh=r),
+    "adr": lambda s, e, r: adr_by_stay_date(start=s, end=e, refresh=r),
+    "dials": lambda s, e, r: marketing_dials(start=s, end=e, period="custom", refresh=r),
+    "table": lambda s, e, r: performance_table(start=s, end=e, refresh=r),
+    "ads-campaigns": lambda s, e, r: ads_campaigns_cached(s, e, "all", refresh=bool(r)),
+    "ads-networks": lambda s, e, r: ads_networks_cached(s, e, refresh=bool(r)),
+}
 
 
-    payload = {"start": start, "end": end, "rows": []}
+async def run_dashboard_widget(name: str, start: str, end: str, refresh: int) -> bytes:
+    """`{"status": ..., "ms": ..., "data"|"detail": ...}` of one widget, as JSON bytes."""
+    t0 = datetime.utcnow()
     try:
-        res = ads_networks_breakdown(start, end)
-        if res:
-            payload.update(res)
+        res = await DASHBOARD_WIDGETS[name](start, end, refresh)
+        body = res.body if isinstance(res, Response) else dump_json(res)
+        head = {"status": "ok"}
+    except HTTPException as e:
+        body, head = None, {"status": "error", "detail": e.detail}
     except Exception as e:
-        print(f"[ADS] /api/ads-networks failed: {e}")
+        print(f"[DASHBOARD] widget {name} failed: {e}")
+        body, head = None, {"status": "error", "detail": "internal error"}
+    head["ms"] = round((datetime.utcnow() - t0).total_seconds() * 1000, 1)
+    out = dump_json(head)
+    return out[:-1] + b',"data":' + body + b"}" if body is not None else out
+
+
+@app.get("/api/dashboard")
+async def dashboard(
+    start: str = Query(...),
+    end: str = Query(...),
+    widgets: str = Query("kpis,acq,revuh,adr,dials"),
+    compare: str = Query(""),
+    refresh: Optional[int] = 0,
+    request: Request = None,
+):
+    try:
+        s, e = parse_dates(start, end)
+    except ValueError as err:
+        raise HTTPException(status_code=422, detail=f"Invalid date format: {str(err)}")
+    if s > e:
+        raise HTTPException(status_code=422, detail="start must not be after end")
+    names = [w.strip() for w in widgets.split(",") if w.strip()]
+    prev_names = [w.strip() for w in compare.split(",") if w.strip()]
+    unknown = sorted(set(names + prev_names) - set(DASHBOARD_WIDGETS))
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown widgets: {', '.join(unknown)}")
+    span = (e - s).days + 1
+    prev_start = (s - timedelta(days=span)).strftime("%Y-%m-%d")
+    prev_end = (s - timedelta(days=1)).strftime("%Y-%m-%d")
+
+    t0 = datetime.utcnow()
+    results = await asyncio.gather(
+        *[run_dashboard_widget(n, start, end, refresh) for n in names],
+        *[run_dashboard_widget(n, prev_start, prev_end, refresh) for n in prev_names],
+    )
 
-    cache.set(cache_key, payload)
-    return payload
+    def section(keys: List[str], parts: List[bytes]) -> bytes:
+        return b"{" + b",".join(dump_json(k) + b":" + p for k, p in zip(keys, parts)) + b"}"
+
+    head = dump_json({
+        "start": start, "end": end, "prev_start": prev_start, "prev_end": prev_end,
+        "ms": round((datetime.utcnow() - t0).total_seconds() * 1000, 1),
+    })
+    body = (
+        head[:-1]
+        + b',"widgets":' + section(names, results[:len(names)])
+        + b',"prev":' + section(prev_names, results[len(names):])
+        + b"}"
+    )
+    # assembled per request (timings differ), so only the cheap gzip variant is offered
+    headers = {"Cache-Control": "no-store", "Vary": "Accept-Encoding"}
+    if request is not None and len(body) >= COMPRESS_MIN_BYTES and "gzip" in accepted_encodings(request.headers.get("accept-encoding")):
+        body = await run_blocking("compress", gzip.compress, body, COMPRESS_GZIP_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 # -------------------- MONTHLY REPORT ENDPOINT --------------------
@@ -1573,8 +3532,72 @@ def current_month_str() -> str:
     today = datetime.utcnow().date()
     return f"{today.year}-{str(today.month).zfill(2)}"
 
-@app.post("/api/monthly-report")
-async def monthly_report(req: MonthlyReportRequest):
+# Cada etapa da coleta tem seu próprio orçamento; estourou → segue com o fallback da etapa.
+MONTHLY_STAGE_TIMEOUT_SECONDS = float(os.environ.get("MONTHLY_STAGE_TIMEOUT_SECONDS", "30"))
+
+
+async def report_stage(name: str, call, fn, *args, default=None, degraded: Optional[List[str]] = None):
+    """Run one data stage of the monthly report under MONTHLY_STAGE_TIMEOUT_SECONDS.
+
+    On timeout/error (or no data source) the stage's `default` is used so the report
+    still goes out, and `name` is appended to `degraded`. The worker thread of a
+    timed-out stage finishes in the background; its result is simply discarded.
+    """
+    try:
+        result = await asyncio.wait_for(call(fn, *args), timeout=MONTHLY_STAGE_TIMEOUT_SECONDS)
+        if result is not None:
+            return result
+        print(f"[REPORT] stage {name} returned no data, using fallback")
+    except asyncio.TimeoutError:
+        print(f"[REPORT] stage {name} exceeded {MONTHLY_STAGE_TIMEOUT_SECONDS}s, using fallback")
+    except Exception as e:
+        print(f"[REPORT] stage {name} failed: {e}")
+    if degraded is not None:
+        degraded.append(name)
+    return default
+
+
+async def gather_monthly_report_data(start: str, end: str, prev_start: str, prev_end: str) -> Dict[str, Any]:
+    """Fan out every GA4/Ads query of the report at once (bounded by the GA4/Ads semaphores).
+
+    The KPI table depends on GA4 + Ads totals of both months; UH, aquisição, PMC
+    e redes só do mês analisado. Nothing else depends on anything, so the phase
+    takes about as long as the slowest single query. "degraded" lists the stages
+    that fell back to their defaults.
+    """
+    degraded: List[str] = []
+    (ga4_curr, ga4_prev, ads_curr, ads_prev, uh, acq, pmc, nets) = await asyncio.gather(
+        report_stage("ga4-kpis", ga4_call, ga4_kpi_totals, start, end, degraded=degraded),
+        report_stage("ga4-kpis-prev", ga4_call, ga4_kpi_totals, prev_start, prev_end, degraded=degraded),
+        report_stage("ads-kpis", ads_call, ads_totals, start, end, degraded=degraded),
+        report_stage("ads-kpis-prev", ads_call, ads_totals, prev_start, prev_end, degraded=degraded),
+        report_stage("uh", ga4_call, uh_totals_month, start, end, default={}, degraded=degraded),
+        report_stage("acq", ga4_call, acq_totals_month, start, end, default={}, degraded=degraded),
+        report_stage("pmc", ga4_call, pmc_series_month, start, end, default=[], degraded=degraded),
+        report_stage("networks", ads_call, networks_month, start, end,
+                     default={"nets": {}, "totals": {}, "shares": {}}, degraded=degraded),
+    )
+    # a KPI total that failed on its own (see ga4_kpi_totals) is packed as 0
+    for name, totals in (("ga4-kpis", ga4_curr), ("ga4-kpis-prev", ga4_prev)):
+        if totals is not None and any(v is None for v in totals.values()):
+            degraded.append(name)
+    return {
+        "degraded": degraded,
+        "kpi_curr": kpis_month_pack(ga4_curr, ads_curr),
+        "kpi_prev": kpis_month_pack(ga4_prev, ads_prev),
+        "uh": uh,
+        "acq": acq,
+        "pmc": pmc,
+        "nets": nets,
+    }
+
+
+async def prepare_monthly_report(req: MonthlyReportRequest) -> Dict[str, Any]:
+    """
+    Everything the report needs before the LLM runs.
+    Returns {"stored": body} when a saved report can be served as is, otherwise
+    {"base": {month, prev_month, summary}, "prompt": str, "data_hash": str, "degraded": [stage...]}.
+    """
     # Validar mês
     try:
         assert len(req.month) == 7 and req.month[4] == "-"
@@ -1597,15 +3620,20 @@ async def monthly_report(req: MonthlyReportRequest):
     prev_m = prev_month_str(req.month)
     prev_start, prev_end = month_bounds(prev_m)
 
-    # Dados (mês e anterior)
-    kpi_curr = kpis_month(start, end)
-    kpi_prev = kpis_month(prev_start, prev_end)
-
-    # UH, Aquisição, PMC, Redes (para o mês)
-    uh = uh_totals_month(start, end)
-    acq = acq_totals_month(start, end)
-    pmc = pmc_series_month(start, end)
-    nets = networks_month(start, end)
+    # Relatório já gerado com dados consolidados → devolve sem recalcular
+    if not req.force:
+        stored = report_store_get(req.month)
+        if stored and report_is_final(end, stored[1]):
+            return {"stored": stored[0]}
+
+    # Dados (mês e anterior): todas as consultas em paralelo, cada uma com seu orçamento de tempo
+    data = await gather_monthly_report_data(start, end, prev_start, prev_end)
+    kpi_curr = data["kpi_curr"]
+    kpi_prev = data["kpi_prev"]
+    uh = data["uh"]
+    acq = data["acq"]
+    pmc = data["pmc"]
+    nets = data["nets"]
 
     # Tabela-resumo + delta
     def delta(a, b):
@@ -1634,31 +3662,108 @@ async def monthly_report(req: MonthlyReportRequest):
         "networks": nets
     }
 
-    prompt = build_gpt_prompt_pt(req.month, prev_m, payload_for_gpt)
-    sections, gpt_meta = run_gpt_sections_safe(prompt)
-
-    # Se GPT ok: incrementa; se falhou, NÃO incrementa
-    # Quota controle removido: define new_used como 0
-    new_used = 0
-    remaining = max(0, 4 - new_used)
+    # Mesmos números de um relatório anterior → reaproveita o texto do LLM
+    data_hash = report_data_hash(payload_for_gpt)
+    if not req.force:
+        stored = report_store_get(req.month, data_hash)
+        if stored:
+            return {"stored": stored[0]}
 
     return {
-        "month": req.month,
-        "prev_month": prev_m,
-        "summary": summary,
-        "sections": sections,
-        "gpt": gpt_meta
-    }
-    # Controle de quota removido
-    return {
-        "month": req.month,
-        "prev_month": prev_m,
-        "summary": summary,
-        "sections": sections,
-        "gpt": gpt_meta
+        "base": {"month": req.month, "prev_month": prev_m, "summary": summary},
+        "prompt": build_gpt_prompt_pt(req.month, prev_m, payload_for_gpt),
+        "data_hash": data_hash,
+        "degraded": data["degraded"],
     }
 
 
+def report_store_put_if_complete(req: MonthlyReportRequest, ctx: Dict[str, Any], body: Dict[str, Any]):
+    """Persist only reports with real LLM text built from every data stage.
+
+    A report whose stages fell back to defaults would otherwise be served as final
+    once the month settles; skipping it makes the next request rebuild it.
+    """
+    if not body["gpt"].get("ok"):
+        return
+    if ctx["degraded"]:
+        print(f"[REPORT] {req.month} not stored, stages fell back: {', '.join(ctx['degraded'])}")
+        return
+    report_store_put(req.month, ctx["data_hash"], body)
+
+
+@app.post("/api/monthly-report")
+async def monthly_report(req: MonthlyReportRequest):
+    ctx = await prepare_monthly_report(req)
+    if "stored" in ctx:
+        return {**ctx["stored"], "cached": True}
+
+    sections, gpt_meta = await run_blocking("llm", run_gpt_sections_safe, ctx["prompt"])
+
+    # Quota controle removido
+    body = {**ctx["base"], "sections": sections, "gpt": gpt_meta}
+    # Só guarda relatórios completos (LLM ok e todas as etapas de dados); senão tenta de novo na próxima
+    report_store_put_if_complete(req, ctx, body)
+    return {**body, "cached": False}
+
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/monthly-report/stream")
+async def monthly_report_stream(req: MonthlyReportRequest):
+    """
+    Mesmo relatório via Server-Sent Events:
+      event: summary  → {month, prev_month, summary} assim que os dados chegam
+      event: section  → {key, text} a cada seção do LLM concluída
+      event: done     → {gpt, cached, sections} (seções completas, já normalizadas)
+    """
+    ctx = await prepare_monthly_report(req)  # erros de validação ainda saem como 422
+
+    async def events():
+        if "stored" in ctx:
+            body = ctx["stored"]
+            yield sse_event("summary", {k: body.get(k) for k in ("month", "prev_month", "summary")})
+            for key, text in (body.get("sections") or {}).items():
+                yield sse_event("section", {"key": key, "text": text})
+            yield sse_event("done", {"gpt": body.get("gpt"), "cached": True, "sections": body.get("sections")})
+            return
+
+        yield sse_event("summary", ctx["base"])
+        scanner = GptSectionScanner()
+        gpt_meta = {"ok": True, "reason": "ok"}
+        try:
+            async for delta in iterate_blocking("llm", stream_gpt_text, ctx["prompt"]):
+                for key, text in scanner.feed(delta):
+                    yield sse_event("section", {"key": key, "text": text})
+            sections = parse_gpt_sections(scanner.buf.strip())
+        except Exception as e:
+            msg = str(e).lower()
+            if "no_api_key" in msg:
+                gpt_meta = {"ok": False, "reason": "no_api_key"}
+            elif "429" in msg or "quota" in msg:
+                gpt_meta = {"ok": False, "reason": "quota_exceeded"}
+            else:
+                print(f"[GPT] stream failed: {e}")
+                gpt_meta = {"ok": False, "reason": "error"}
+            sections = {**gpt_fallback_sections(), **scanner.done}
+
+        # seções que o scanner não pegou (ex.: JSON fora do formato) saem no fim
+        for key, text in sections.items():
+            if scanner.done.get(key) != text:
+                yield sse_event("section", {"key": key, "text": text})
+
+        body = {**ctx["base"], "sections": sections, "gpt": gpt_meta}
+        report_store_put_if_complete(req, ctx, body)
+        yield sse_event("done", {"gpt": gpt_meta, "cached": False, "sections": sections})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 
 class FeedbackResponse(BaseModel):
     success: bool
@@ -1685,7 +3790,7 @@ async def submit_feedback(
 
     try:
         # Use the global Supabase client
-        supabase = build_supabase_client()
+        supabase = await run_blocking("supabase", build_supabase_client)
         if not supabase:
             print("[FEEDBACK] ❌ Falha ao conectar com Supabase")
             return FeedbackResponse(success=False, message="Erro de conexão com banco de dados")
@@ -1719,7 +3824,7 @@ async def submit_feedback(
         print(f"[FEEDBACK] Dados para inserir: {list(feedback_data.keys())}")
 
         # Insere no Supabase
-        result = supabase.table("feedbacks").insert(feedback_data).execute()
+        result = await run_blocking("supabase", supabase.table("feedbacks").insert(feedback_data).execute)
         print(f"[FEEDBACK] Resultado Supabase: success={bool(result.data)}, count={len(result.data) if result.data else 0}")
         
         if hasattr(result, 'error') and result.error:
@@ -1797,12 +3902,12 @@ def validate_email_domain(email: str) -> bool:
 
 async def get_user_by_email(email: str) -> Optional[dict]:
     """Get user from Supabase by email"""
-    supabase = build_supabase_client()
+    supabase = await run_blocking("supabase", build_supabase_client)
     if not supabase:
         return None
     
     try:
-        result = supabase.from_("users").select("*").eq("email", email).execute()
+        result = await run_blocking("supabase", supabase.from_("users").select("*").eq("email", email).execute)
         if result.data and len(result.data) > 0:
             return result.data[0]
         return None
@@ -1813,7 +3918,7 @@ async def get_user_by_email(email: str) -> Optional[dict]:
 
 async def create_user(name: str, email: str, password: str) -> dict:
     """Create new user in Supabase"""
-    supabase = build_supabase_client()
+    supabase = await run_blocking("supabase", build_supabase_client)
     if not supabase:
         raise HTTPException(status_code=500, detail="Database connection failed")
     
@@ -1821,10 +3926,10 @@ async def create_user(name: str, email: str, password: str) -> dict:
         user_data = {
             "name": name,
             "email": email.lower(),
-            "password_hash": get_password_hash(password)
+            "password_hash": await run_blocking("auth", get_password_hash, password)
         }
         
-        result = supabase.from_("users").insert(user_data).execute()
+        result = await run_blocking("supabase", supabase.from_("users").insert(user_data).execute)
         
         if result.data and len(result.data) > 0:
             return result.data[0]
@@ -1899,7 +4004,7 @@ async def login(user_data: UserLogin):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     # Verify password
-    if not verify_password(user_data.password, user["password_hash"]):
+    if not await run_blocking("auth", verify_password, user_data.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     # Create access token
@@ -1930,13 +4035,13 @@ async def get_current_user(current_user: dict = Depends(verify_token)):
 async def setup_users_table():
     """Temporary endpoint to create users table"""
     try:
-        supabase = build_supabase_client()
+        supabase = await run_blocking("supabase", build_supabase_client)
         if not supabase:
             return {"success": False, "message": "Supabase connection failed"}
         
         # Check if table exists by trying to query it
         try:
-            supabase.table("users").select("id").limit(1).execute()
+            await run_blocking("supabase", supabase.table("users").select("id").limit(1).execute)
             return {"success": True, "message": "Users table already exists"}
         except Exception:
             return {
@@ -1958,15 +4063,87 @@ CREATE TABLE users (
         return {"success": False, "message": f"Error: {str(e)}"}
 
 
+# -------------------- PREFETCH LOOP --------------------
+
+PREFETCH_ENDPOINTS = {
+    "kpis": get_kpis,
+    "acq": acquisition_by_channel,
+    "revuh": revenue_by_uh,
+    "adr": adr_by_stay_date,
+    "dials": marketing_dials,
+    "ads-campaigns": ads_campaigns,
+    "ads-networks": ads_networks,
+}
+
+_prefetch_task: Optional[asyncio.Task] = None
+
+
+async def _prefetch_forever():
+    while True:
+        try:
+            await prefetcher.run_cycle()
+        except Exception as e:
+            print(f"[PREFETCH] cycle failed: {e}")
+        await asyncio.sleep(PREFETCH_INTERVAL_SECONDS)
+
+
+@app.on_event("startup")
+async def start_prefetcher():
+    global _prefetch_task
+    if PREFETCH_ENABLED:
+        _prefetch_task = asyncio.create_task(_prefetch_forever())
+
+
+@app.on_event("shutdown")
+async def stop_prefetcher():
+    if _prefetch_task:
+        _prefetch_task.cancel()
+
+
 # -------------------- HEALTH --------------------
 
+@app.get("/api/cache-stats")
+async def cache_stats(top: int = Query(20)):
+    """Ocupação do cache em memória e as chaves mais pesadas (estimativa em bytes)."""
+    sizes = sorted(cache.sizes().items(), key=lambda kv: kv[1], reverse=True)[:max(0, top)]
+    return {**cache.stats(), "largest": [{"key": k, "bytes": b} for k, b in sizes]}
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of the METRICS registry (this worker only)."""
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/ga4-quota")
+async def ga4_quota_status():
+    """Cota GA4 restante (tokens por hora/dia) segundo o último relatório executado."""
+    return {
+        **ga4_quota.snapshot(),
+        "reserve": {
+            "tokens_per_hour": GA4_QUOTA_MIN_HOURLY_TOKENS,
+            "tokens_per_day": GA4_QUOTA_MIN_DAILY_TOKENS,
+            "tokens_per_project_per_hour": GA4_QUOTA_MIN_PROJECT_HOURLY_TOKENS,
+        },
+    }
+
+
 @app.get("/api/health")
 async def health():
     integrations = {
         "ga4": bool(os.getenv("GA4_PROPERTY_ID") and os.getenv("GA4_PRIVATE_KEY")),
         "google_ads": bool(os.getenv("ADS_DEVELOPER_TOKEN") and os.getenv("ADS_OAUTH_CLIENT_ID"))
     }
-    return {"status": "ok", "integrations": integrations}
+    return {
+        "status": "ok",
+        "integrations": integrations,
+        "startup": {**startup_stats, "integration_init_seconds": dict(integration_init_seconds)},
+        "ga4_quota": ga4_quota.snapshot(),
+    }
+
+
+startup_stats["import_seconds"] = round(time.perf_counter() - _IMPORT_STARTED, 3)
+print(f"[STARTUP] server.py imported in {startup_stats['import_seconds']}s")
 
 
 
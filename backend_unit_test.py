@@ -0,0 +1,543 @@
+"""
+In-process tests for the backend caching/response layer (no live server, no GA4/Ads credentials).
+Run with: python -m pytest -q backend_unit_test.py
+"""
+import asyncio
+import gzip
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+TMP_DIR = tempfile.mkdtemp(prefix="calma-test-")
+os.environ["FACTS_DB_PATH"] = os.path.join(TMP_DIR, "facts.sqlite")
+os.environ["PREFETCH_ENABLED"] = "0"
+os.environ.pop("CACHE_SHARED_PATH", None)
+sys.path.insert(0, str(Path(__file__).with_name("backend")))
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+import server  # noqa: E402
+
+# module-level semaphores bind to the first loop that waits on them: keep a single loop
+LOOP = asyncio.new_event_loop()
+
+
+def run(coro):
+    return LOOP.run_until_complete(coro)
+
+
+def policy(endpoint="salesuh"):
+    return server.cache_policy(endpoint, "2025-01-31")
+
+
+class Counter:
+    """compute() stand-in that counts its calls."""
+
+    def __init__(self, value=None, delay=0.0):
+        self.calls = 0
+        self.value = value
+        self.delay = delay
+
+    async def __call__(self):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return self.value if self.value is not None else {"n": self.calls}
+
+
+@pytest.fixture
+def client():
+    return TestClient(server.app)
+
+
+@pytest.fixture
+def fresh_cache(monkeypatch):
+    """An empty L1-only cache in place of the module singleton."""
+    cache = server.BoundedCache()
+    monkeypatch.setattr(server, "cache", cache)
+    return cache
+
+
+# -------------------- no shared tier (default config) --------------------
+
+def test_miss_then_hit_without_shared_tier():
+    cache = server.BoundedCache()
+    assert cache.shared is None
+    compute = Counter()
+    assert run(cache.get_or_compute("salesuh-a", policy(), compute)) == {"n": 1}
+    assert run(cache.get_or_compute("salesuh-a", policy(), compute)) == {"n": 1}
+    assert compute.calls == 1
+    assert run(cache.freshest("salesuh-missing", 0)) is None
+
+
+def test_endpoints_without_shared_tier(client, fresh_cache):
+    params = {"start": "2025-01-01", "end": "2025-01-31"}
+    for path in ("/api/kpis", "/api/revenue-by-uh", "/api/sales-uh-stacked"):
+        assert client.get(path, params=params).status_code == 200, path
+
+
+def test_prefetch_cycle_without_shared_tier(fresh_cache):
+    calls = []
+
+    async def fake_call(endpoint, params, refresh):
+        calls.append((endpoint, refresh))
+
+    prefetcher = server.Prefetcher()
+    prefetcher._call = fake_call
+    prefetcher.day = datetime.utcnow().date()
+    prefetcher.record("salesuh", "salesuh-2025-01-01-2025-01-31", {"start": "2025-01-01", "end": "2025-01-31"}, "2025-01-31")
+    assert run(prefetcher.run_cycle()) == 1
+    assert calls == [("salesuh", True)]
+
+
+# -------------------- single-flight --------------------
+
+def test_concurrent_misses_share_one_computation():
+    cache = server.BoundedCache()
+    compute = Counter(delay=0.05)
+
+    async def burst():
+        return await asyncio.gather(*[cache.get_or_compute("salesuh-b", policy(), compute) for _ in range(10)])
+
+    assert run(burst()) == [{"n": 1}] * 10
+    assert compute.calls == 1
+    assert not cache.inflight
+
+
+def test_refresh_storm_is_coalesced():
+    cache = server.BoundedCache()
+    compute = Counter(delay=0.05)
+
+    async def burst():
+        return await asyncio.gather(*[cache.get_or_compute("salesuh-c", policy(), compute, refresh=True) for _ in range(5)])
+
+    assert run(burst()) == [{"n": 1}] * 5
+    assert compute.calls == 1
+
+
+def test_cancelled_waiter_does_not_cancel_the_fill():
+    cache = server.BoundedCache()
+    compute = Counter(delay=0.05)
+
+    async def scenario():
+        waiter = asyncio.ensure_future(cache.get_or_compute("salesuh-d", policy(), compute))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        return await cache.get_or_compute("salesuh-d", policy(), compute)
+
+    assert run(scenario()) == {"n": 1}
+    assert compute.calls == 1
+
+
+def test_failed_fill_is_not_cached():
+    cache = server.BoundedCache()
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("upstream down")
+        return {"ok": True}
+
+    with pytest.raises(RuntimeError):
+        run(cache.get_or_compute("salesuh-e", policy(), flaky))
+    assert run(cache.get_or_compute("salesuh-e", policy(), flaky)) == {"ok": True}
+    assert len(calls) == 2
+
+
+# -------------------- bounded LRU + TTL --------------------
+
+def clocked(cache, start=1_700_000_000.0):
+    """Drive the cache's clock by hand; returns the mutable [now]."""
+    clock = [start]
+    cache._now = lambda: clock[0]
+    return clock
+
+
+def test_lru_eviction_by_entries():
+    cache = server.BoundedCache(max_entries=2)
+    cache.set("salesuh-1", 1)
+    cache.set("salesuh-2", 2)
+    assert cache.get("salesuh-1") == 1  # now most recently used
+    cache.set("salesuh-3", 3)
+    assert cache.get("salesuh-2") is None
+    assert cache.get("salesuh-1") == 1 and cache.get("salesuh-3") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_eviction_by_bytes():
+    value = {"x": "y" * 100}
+    size = server.estimate_size(value)
+    cache = server.BoundedCache(max_bytes=size * 2 + size // 2)
+    for i in range(3):
+        cache.set(f"salesuh-{i}", dict(value))
+    assert list(cache.store) == ["salesuh-1", "salesuh-2"]
+    assert cache.bytes == 2 * size == sum(cache.sizes().values())
+    cache.set("salesuh-big", {"x": "y" * size * 3})  # larger than the whole budget: not stored
+    assert cache.get("salesuh-big") is None
+    assert len(cache.store) == 2
+
+
+def test_ttl_expiry_and_sweep():
+    cache = server.BoundedCache()
+    clock = clocked(cache)
+    cache.set("salesuh-short", 1, ttl_seconds=10)
+    cache.set("salesuh-long", 2, ttl_seconds=100)
+    assert cache.get("salesuh-short", ttl_seconds=5) == 1
+    clock[0] += 11
+    assert cache.sweep() == 1
+    assert cache.get("salesuh-short") is None
+    assert cache.get("salesuh-long") == 2
+    assert cache.bytes == server.estimate_size(2)
+    clock[0] += 100
+    assert cache.get("salesuh-long") is None
+    assert cache.stats()["entries"] == 0 and cache.bytes == 0
+
+
+# -------------------- stale-while-revalidate --------------------
+
+def test_swr_soft_and_hard_ttl():
+    cache = server.BoundedCache()
+    clock = clocked(cache)
+    swr = server.CachePolicy(soft_ttl=10, hard_ttl=100)
+    compute = Counter(delay=0.01)
+
+    async def scenario():
+        first = await cache.get_or_compute("salesuh-swr", swr, compute)
+        clock[0] += 5
+        fresh = await cache.get_or_compute("salesuh-swr", swr, compute)
+        clock[0] += 45  # past soft TTL: stale value now, one refresh in background
+        stale = await asyncio.gather(*[cache.get_or_compute("salesuh-swr", swr, compute) for _ in range(3)])
+        assert len(cache.inflight) == 1
+        await asyncio.gather(*cache.inflight.values())
+        refreshed = await cache.get_or_compute("salesuh-swr", swr, compute)
+        clock[0] += 200  # past hard TTL: computed while the caller waits
+        expired = await cache.get_or_compute("salesuh-swr", swr, compute)
+        return first, fresh, stale, refreshed, expired
+
+    first, fresh, stale, refreshed, expired = run(scenario())
+    assert first == fresh == {"n": 1}
+    assert stale == [{"n": 1}] * 3
+    assert refreshed == {"n": 2}
+    assert expired == {"n": 3}
+    assert compute.calls == 3
+
+
+def test_swr_policy_adds_stale_window():
+    p = server.swr_policy(60)
+    assert p.soft_ttl == 60
+    assert p.hard_ttl == 60 + server.CACHE_STALE_SECONDS
+
+
+# -------------------- shared (SQLite) tier --------------------
+
+@pytest.fixture
+def shared_path(tmp_path):
+    return str(tmp_path / "cache.sqlite")
+
+
+def wait_shared(tier, key, timeout=2.0):
+    """Write-through is fire-and-forget: poll until the entry lands."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        hit = tier.get(key)
+        if hit is not None:
+            return hit
+        time.sleep(0.01)
+    return None
+
+
+def test_shared_tier_serves_other_workers(shared_path):
+    worker_a = server.BoundedCache(shared=server.SharedCacheTier(shared_path))
+    worker_b = server.BoundedCache(shared=server.SharedCacheTier(shared_path))
+    assert run(worker_a.get_or_compute("salesuh-s", policy(), Counter())) == {"n": 1}
+    _, ts, _ = wait_shared(worker_b.shared, "salesuh-s")
+    other = Counter()
+    assert run(worker_b.get_or_compute("salesuh-s", policy(), other)) == {"n": 1}
+    assert other.calls == 0
+    assert worker_b.store["salesuh-s"]["ts"] == ts  # promoted with its original timestamp
+
+
+def test_shared_tier_picks_up_newer_entry_for_stale_l1(shared_path):
+    worker = server.BoundedCache(shared=server.SharedCacheTier(shared_path))
+    clock = clocked(worker, time.time())  # the shared tier checks expiry against real time
+    worker._put("salesuh-n", {"v": "old"}, clock[0] - 50, 1000)
+    worker.shared.set("salesuh-n", {"v": "new"}, clock[0] - 1, 1000)
+    compute = Counter()
+    swr = server.CachePolicy(soft_ttl=10, hard_ttl=1000)
+    assert run(worker.get_or_compute("salesuh-n", swr, compute)) == {"v": "new"}
+    assert compute.calls == 0 and not worker.inflight
+
+
+def test_shared_tier_never_replaces_newer_entry(shared_path):
+    tier = server.SharedCacheTier(shared_path)
+    now = time.time()
+    tier.set("salesuh-o", {"v": 2}, now, 100)
+    tier.set("salesuh-o", {"v": 1}, now - 50, 100)
+    assert tier.get("salesuh-o")[0] == {"v": 2}
+    tier.set("salesuh-o", {"v": 3}, now + 1, 100)
+    assert tier.get("salesuh-o")[0] == {"v": 3}
+
+
+def test_shared_tier_round_trips_cached_bodies(shared_path):
+    tier = server.SharedCacheTier(shared_path)
+    body = server.CachedBody.compressed(b'{"k":"' + b"v" * 4096 + b'"}')
+    tier.set("salesuh-body", body, time.time(), 100)
+    assert tier.get("salesuh-body")[0] == body
+
+
+def test_shared_tier_expiry_and_leases(shared_path):
+    tier = server.SharedCacheTier(shared_path)
+    tier.set("salesuh-x", {"v": 1}, time.time() - 20, 10)
+    assert tier.get("salesuh-x") is None
+    assert tier.claim("prefetch:salesuh-x", 60) is True
+    assert tier.claim("prefetch:salesuh-x", 60) is False
+    tier.sweep()
+    assert tier._conn().execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0] == 0
+
+
+def test_fallback_values_stay_local(shared_path):
+    worker = server.BoundedCache(shared=server.SharedCacheTier(shared_path))
+
+    async def degraded():
+        server.note_fallback("ga4")
+        return {"mock": True}
+
+    assert run(worker.get_or_compute("kpis-f", policy("kpis"), degraded)) == {"mock": True}
+    assert worker.store["kpis-f"]["ttl"] == server.CACHE_FALLBACK_TTL_SECONDS
+    server.get_executor("cache").submit(lambda: None).result()
+    assert worker.shared.get("kpis-f") is None
+
+
+def test_endpoint_smoke_with_shared_tier(client, shared_path, monkeypatch):
+    params = {"start": "2025-01-01", "end": "2025-01-31"}
+    monkeypatch.setattr(server, "cache", server.BoundedCache(shared=server.SharedCacheTier(shared_path)))
+    first = client.get("/api/sales-uh-stacked", params=params)
+    assert first.status_code == 200
+    assert wait_shared(server.cache.shared, "salesuh-2025-01-01-2025-01-31") is not None
+    # another worker: L1 miss, served from the shared tier
+    monkeypatch.setattr(server, "cache", server.BoundedCache(shared=server.SharedCacheTier(shared_path)))
+    second = client.get("/api/sales-uh-stacked", params=params)
+    assert second.content == first.content
+    revalidated = client.get("/api/sales-uh-stacked", params=params, headers={"If-None-Match": first.headers["etag"]})
+    assert revalidated.status_code == 304
+    assert client.get("/api/kpis", params=params).status_code == 200
+
+
+# -------------------- prefetcher --------------------
+
+def hot_prefetcher(calls):
+    async def fake_call(endpoint, params, refresh):
+        calls.append((endpoint, refresh))
+
+    prefetcher = server.Prefetcher()
+    prefetcher._call = fake_call
+    prefetcher.day = datetime.utcnow().date()
+    prefetcher.record("salesuh", "salesuh-2025-01-01-2025-01-31", {"start": "2025-01-01", "end": "2025-01-31"}, "2025-01-31")
+    return prefetcher
+
+
+def test_prefetch_skips_keys_refreshed_by_another_worker(shared_path, monkeypatch):
+    monkeypatch.setattr(server, "cache", server.BoundedCache(shared=server.SharedCacheTier(shared_path)))
+    server.cache.shared.set("salesuh-2025-01-01-2025-01-31", {"v": 1}, time.time(), 3600)
+    calls = []
+    assert run(hot_prefetcher(calls).run_cycle()) == 0
+    assert calls == []
+
+
+def test_prefetch_lease_lets_one_worker_refresh(shared_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(server, "cache", server.BoundedCache(shared=server.SharedCacheTier(shared_path)))
+    run(hot_prefetcher(calls).run_cycle())
+    monkeypatch.setattr(server, "cache", server.BoundedCache(shared=server.SharedCacheTier(shared_path)))
+    run(hot_prefetcher(calls).run_cycle())
+    assert calls == [("salesuh", True)]
+
+
+# -------------------- pre-serialized responses --------------------
+
+RANGE = {"start": "2025-01-01", "end": "2025-01-31"}
+SALESUH_KEY = "salesuh-2025-01-01-2025-01-31"
+
+
+def test_hits_serve_the_stored_body(client, fresh_cache):
+    first = client.get("/api/sales-uh-stacked", params=RANGE)
+    second = client.get("/api/sales-uh-stacked", params=RANGE)
+    assert first.status_code == second.status_code == 200
+    assert second.content == first.content  # the mock is random: same bytes means a cache hit
+    entry = fresh_cache.store[SALESUH_KEY]["val"]
+    assert isinstance(entry, server.CachedBody)
+    assert entry.body == first.content
+    assert first.headers["content-type"] == "application/json"
+
+
+def test_bodies_are_validated_against_the_response_model():
+    body = server.dump_json({"series_labels": ["A"], "points": [], "extra": 1}, server.StackedBarsResponse)
+    assert b"extra" not in body
+    assert server.dump_json({"a": "é"}) == '{"a":"é"}'.encode("utf-8")
+
+
+def test_plain_entries_are_still_served(client, fresh_cache):
+    payload = {"series_labels": ["A"], "points": []}
+    fresh_cache.set(SALESUH_KEY, payload)
+    res = client.get("/api/sales-uh-stacked", params=RANGE)
+    assert res.status_code == 200
+    assert res.json() == payload
+
+
+# -------------------- ETag / If-None-Match --------------------
+
+def test_strong_etag_and_304(client, fresh_cache):
+    first = client.get("/api/sales-uh-stacked", params=RANGE, headers={"Accept-Encoding": "identity"})
+    etag = first.headers["etag"]
+    assert etag.startswith('"') and etag.endswith('"')  # strong
+    assert first.headers["cache-control"] == "no-cache"
+    for tag in (etag, "W/" + etag, f'"other", {etag}', "*"):
+        res = client.get("/api/sales-uh-stacked", params=RANGE, headers={"If-None-Match": tag})
+        assert res.status_code == 304, tag
+        assert res.content == b""
+        assert "etag" in res.headers
+    res = client.get("/api/sales-uh-stacked", params=RANGE, headers={"If-None-Match": '"other"'})
+    assert res.status_code == 200
+
+
+def test_etag_follows_content(client, fresh_cache):
+    first = client.get("/api/sales-uh-stacked", params=RANGE)
+    refreshed = client.get("/api/sales-uh-stacked", params={**RANGE, "refresh": 1}, headers={"If-None-Match": first.headers["etag"]})
+    assert refreshed.status_code == 200  # random mock: new content, new tag
+    assert refreshed.headers["etag"] != first.headers["etag"]
+    assert server.CachedBody.of(b"a").etag == server.CachedBody.of(b"a").etag != server.CachedBody.of(b"b").etag
+
+
+def test_etag_matches_any_representation():
+    entry = server.CachedBody.compressed(b"x" * 4096)
+    _, gz_tag = entry.variant("gzip")
+    assert gz_tag != entry.etag
+    assert server.etag_matches(gz_tag, entry)
+    assert not server.etag_matches(None, entry)
+    assert not server.etag_matches('"nope"', entry)
+
+
+# -------------------- precompressed bodies --------------------
+
+def test_accept_encoding_parsing():
+    assert server.accepted_encodings(None) == set()
+    assert server.accepted_encodings("gzip;q=0, br;q=0.5, Identity") == {"br", "identity"}
+    entry = server.CachedBody.compressed(b"x" * 4096)
+    assert server.pick_encoding("gzip, br", entry) == "br"
+    assert server.pick_encoding("gzip, br;q=0", entry) == "gzip"
+    assert server.pick_encoding("*", entry) == "br"
+    assert server.pick_encoding("identity", entry) == "identity"
+    assert gzip.decompress(entry.gzip) == entry.body
+
+
+def test_small_bodies_are_not_compressed():
+    entry = server.CachedBody.compressed(b"{}")
+    assert entry.gzip is None and entry.br is None
+    assert server.pick_encoding("gzip, br", entry) == "identity"
+
+
+@pytest.mark.parametrize("accept, encoding", [("br, gzip", "br"), ("gzip", "gzip"), ("identity", None)])
+def test_responses_use_stored_variants(client, fresh_cache, accept, encoding):
+    if encoding == "br" and server.brotli is None:
+        pytest.skip("brotli not installed")
+    plain = client.get("/api/sales-uh-stacked", params=RANGE, headers={"Accept-Encoding": "identity"})
+    assert len(plain.content) >= server.COMPRESS_MIN_BYTES
+    res = client.get("/api/sales-uh-stacked", params=RANGE, headers={"Accept-Encoding": accept})
+    assert res.headers.get("content-encoding") == encoding
+    assert res.headers["vary"] == "Accept-Encoding"
+    assert res.content == plain.content  # decoded by the client
+    assert (res.headers["etag"] == plain.headers["etag"]) == (encoding is None)
+
+
+# -------------------- /api/dashboard --------------------
+
+def test_dashboard_splices_widget_bodies(client, fresh_cache):
+    res = client.get("/api/dashboard", params={**RANGE, "widgets": "kpis,revuh", "compare": "kpis"})
+    assert res.status_code == 200
+    data = res.json()
+    assert (data["start"], data["end"]) == ("2025-01-01", "2025-01-31")
+    assert (data["prev_start"], data["prev_end"]) == ("2024-12-01", "2024-12-31")
+    assert list(data["widgets"]) == ["kpis", "revuh"] and list(data["prev"]) == ["kpis"]
+    for widget in (*data["widgets"].values(), *data["prev"].values()):
+        assert widget["status"] == "ok" and "ms" in widget
+    # each widget carries the same payload as its own endpoint (served from the cache)
+    assert data["widgets"]["kpis"]["data"] == client.get("/api/kpis", params=RANGE).json()
+    prev = {"start": data["prev_start"], "end": data["prev_end"]}
+    assert data["prev"]["kpis"]["data"] == client.get("/api/kpis", params=prev).json()
+
+
+def test_dashboard_reports_failing_widgets(client, fresh_cache, monkeypatch):
+    async def broken(s, e, r):
+        raise RuntimeError("boom")
+
+    monkeypatch.setitem(server.DASHBOARD_WIDGETS, "revuh", broken)
+    data = client.get("/api/dashboard", params={**RANGE, "widgets": "kpis,revuh"}).json()
+    assert data["widgets"]["kpis"]["status"] == "ok"
+    assert data["widgets"]["revuh"] == {"status": "error", "detail": "internal error", "ms": data["widgets"]["revuh"]["ms"]}
+
+
+def test_dashboard_gzip_and_validation(client, fresh_cache):
+    res = client.get("/api/dashboard", params=RANGE, headers={"Accept-Encoding": "gzip"})
+    assert res.headers.get("content-encoding") == "gzip"
+    assert res.headers["cache-control"] == "no-store"
+    assert set(res.json()["widgets"]) == {"kpis", "acq", "revuh", "adr", "dials"}
+    assert client.get("/api/dashboard", params={**RANGE, "widgets": "kpis,nope"}).status_code == 422
+    assert client.get("/api/dashboard", params={"start": "2025-13-01", "end": "2025-01-31"}).status_code == 422
+
+
+def test_dashboard_rejects_inverted_range(client, fresh_cache):
+    res = client.get("/api/dashboard", params={"start": "2025-01-31", "end": "2025-01-01"})
+    assert res.status_code == 422
+    assert client.get("/api/dashboard", params={"start": "2025-01-31", "end": "2025-01-31"}).status_code == 200
+
+
+# -------------------- GA4 day store --------------------
+
+def ga4_response(rows, row_count):
+    types = pytest.importorskip("google.analytics.data_v1beta.types")
+    return types.RunReportResponse(
+        row_count=row_count,
+        rows=[
+            types.Row(dimension_values=[types.DimensionValue(value=day.replace("-", ""))],
+                      metric_values=[types.MetricValue(value=str(v)) for v in values])
+            for day, values in rows
+        ],
+    )
+
+
+@pytest.fixture
+def ga4_store(monkeypatch):
+    monkeypatch.setattr(server, "GA4_PROPERTY_ID", f"test-{time.time_ns()}")  # fresh partitions per test
+    monkeypatch.setattr(server, "GA4_STORE_PAGE_ROWS", 2)
+
+
+def test_ga4_store_pages_through_long_reports(ga4_store, monkeypatch):
+    days = [("2025-01-01", (1, 1)), ("2025-01-02", (2, 1)), ("2025-01-03", (3, 1))]
+    offsets = []
+
+    def fake_run_report(req):
+        offsets.append(req.offset)
+        return ga4_response(days[req.offset:req.offset + req.limit], len(days))
+
+    monkeypatch.setattr(server, "ga4_run_report", fake_run_report)
+    parts, req, ingest = server.ga4_partitions_plan([], ["itemRevenue", "itemsPurchased"], "2025-01-01", "2025-01-03")
+    ingest(fake_run_report(req))
+    assert offsets == [0, 2]
+    assert parts == {"2025-01-01": [[1.0, 1.0]], "2025-01-02": [[2.0, 1.0]], "2025-01-03": [[3.0, 1.0]]}
+    stored, req, _ = server.ga4_partitions_plan([], ["itemRevenue", "itemsPurchased"], "2025-01-01", "2025-01-03")
+    assert req is None and stored == parts
+
+
+def test_ga4_store_refuses_truncated_reports(ga4_store, monkeypatch):
+    monkeypatch.setattr(server, "ga4_run_report", lambda req: ga4_response([], 3))
+    parts, req, ingest = server.ga4_partitions_plan([], ["itemRevenue", "itemsPurchased"], "2025-01-01", "2025-01-03")
+    with pytest.raises(RuntimeError):
+        ingest(ga4_response([("2025-01-01", (1, 1)), ("2025-01-02", (2, 1))], 3))
+    assert parts == {}
+    _, req, _ = server.ga4_partitions_plan([], ["itemRevenue", "itemsPurchased"], "2025-01-01", "2025-01-03")
+    assert req is not None  # nothing was persisted
@@ -47,13 +47,8 @@ function ensureApiBase(path) {
 
 async function fetchMonthlyDatasets(month) {
   const { start, end, spanDays } = monthBoundsJS(month)
-  const [revUH, acq, pmc, nets] = await Promise.all([
-    api('/revenue-by-uh', { start, end }),
-    api('/acquisition-by-channel', { start, end, metric: 'users' }),
-    api('/adr', { start, end }),
-    api('/ads-networks', { month })
-  ])
-  return { revUH, acq, pmc, nets, spanDays }
+  const { widgets } = await dashboardApi(start, end, ['revuh', 'acq', 'adr', 'ads-networks'])
+  return { revUH: widgets.revuh, acq: widgets.acq, pmc: widgets.adr, nets: widgets['ads-networks'], spanDays }
 }
 
 
@@ -124,6 +119,16 @@ async function api(path, params) {
   return res.json()
 }
 
+// Vários widgets numa requisição só (/api/dashboard); falha de qualquer widget = erro, como antes
+async function dashboardApi(start, end, widgets, compare = []) {
+  const res = await api('/dashboard', { start, end, widgets: widgets.join(','), compare: compare.join(',') })
+  const unwrap = (section) => Object.fromEntries(Object.entries(section || {}).map(([name, w]) => {
+    if (w.status !== 'ok') throw new Error(`API error (${name})`)
+    return [name, w.data]
+  }))
+  return { widgets: unwrap(res.widgets), prev: unwrap(res.prev) }
+}
+
 function Icon({ name, className = 'w-4 h-4 text-elegant' }) {
   const S = { fill: 'none', stroke: 'currentColor', strokeWidth: 1.8, strokeLinecap: 'round', strokeLinejoin: 'round' }
   if (name === 'home') return (<svg className={className} viewBox="0 0 32 32"><circle cx="16" cy="16" r="13" {...S} /><path {...S} d="M8 16l8-7 8 7M11 18v7h10v-7" /></svg>)
@@ -344,20 +349,16 @@ function useDashboardData(range) {
         // Removed duplicate 'params' declaration to fix redeclaration error
         const apiParams = { start: range.start, end: range.end }
         const prev = getPrevRange(range)
-        const [kpis, acq, revUH, adr, dials] = await Promise.all([
-          api('/kpis', apiParams),
-          api('/acquisition-by-channel', { ...apiParams, metric: 'users' }),
-          api('/revenue-by-uh', apiParams),
-          api('/adr', apiParams),
-          api('/marketing-dials', apiParams)
-        ])
-        const [prevAcq, prevRevUH, prevAdr, prevDials] = await Promise.all([
-          api('/acquisition-by-channel', { start: prev.start, end: prev.end, metric: 'users' }),
-          api('/revenue-by-uh', { start: prev.start, end: prev.end }),
-          api('/adr', { start: prev.start, end: prev.end }),
-          api('/marketing-dials', { start: prev.start, end: prev.end })
-        ])
-        if (!cancelled) setData({ kpis, acq, revUH, adr, dials, prevAcq, prevRevUH, prevAdr, prevDials, prev })
+        // período atual + anterior (mesma duração) numa única requisição
+        const { widgets: cur, prev: old } = await dashboardApi(
+          apiParams.start, apiParams.end,
+          ['kpis', 'acq', 'revuh', 'adr', 'dials'],
+          ['acq', 'revuh', 'adr', 'dials']
+        )
+        if (!cancelled) setData({
+          kpis: cur.kpis, acq: cur.acq, revUH: cur.revuh, adr: cur.adr, dials: cur.dials,
+          prevAcq: old.acq, prevRevUH: old.revuh, prevAdr: old.adr, prevDials: old.dials, prev
+        })
       } finally {
         if (!cancelled) setLoading(false)
       }
@@ -1233,14 +1234,39 @@ Se você tiver qualquer dúvidas, pergunta, sugestão de melhoria, ou simplesmen
 
 
 // === Monthly Report (PDF) ===
+// Lê o SSE de /monthly-report/stream; onEvent(nome, dados) a cada evento
+async function readReportStream(res, onEvent) {
+  const reader = res.body.getReader()
+  const decoder = new TextDecoder()
+  let buf = ''
+  for (;;) {
+    const { value, done } = await reader.read()
+    if (done) break
+    buf += decoder.decode(value, { stream: true })
+    let idx
+    while ((idx = buf.indexOf('\n\n')) >= 0) {
+      const raw = buf.slice(0, idx)
+      buf = buf.slice(idx + 2)
+      let event = 'message', data = ''
+      for (const line of raw.split('\n')) {
+        if (line.startsWith('event: ')) event = line.slice(7)
+        else if (line.startsWith('data: ')) data += line.slice(6)
+      }
+      if (data) onEvent(event, JSON.parse(data))
+    }
+  }
+}
+
 function MonthlyReportButton({ month }) {
   const [busy, setBusy] = useState(false)
+  const [progress, setProgress] = useState('')
   const tip = "Você tem direito a 4 relatórios/mês"
   async function generate() {
     if (!month) { alert('Selecione um mês completo'); return }
     setBusy(true)
+    setProgress('')
     try {
-      const res = await fetch(ensureApiBase('/monthly-report'), {
+      const res = await fetch(ensureApiBase('/monthly-report/stream'), {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ month })
@@ -1251,7 +1277,16 @@ function MonthlyReportButton({ month }) {
         return
       }
       if (!res.ok) { throw new Error('Falha ao gerar resumo mensal') }
-      const data = await res.json()
+      // capturas dos gráficos correm enquanto o texto é gerado
+      const imgsPromise = captureMonthlyCharts(month)
+      let data = null
+      let count = 0
+      await readReportStream(res, (event, payload) => {
+        if (event === 'summary') { data = { ...payload, sections: {} }; setProgress('0/6') }
+        else if (event === 'section' && data) { data.sections[payload.key] = payload.text; setProgress(`${Math.min(++count, 6)}/6`) }
+        else if (event === 'done' && data) { data.sections = payload.sections; data.gpt = payload.gpt }
+      })
+      if (!data || !data.gpt) { throw new Error('Resumo mensal incompleto') }
 
       // >>> AVISO GPT
       if (data?.gpt && data.gpt.ok === false) {
@@ -1264,13 +1299,14 @@ function MonthlyReportButton({ month }) {
         }
       }
 
-      const imgs = await captureMonthlyCharts(month)
+      const imgs = await imgsPromise
       await buildMonthlyPdf(month, data, imgs)
     } catch (e) {
       console.error(e)
       alert('Não foi possível gerar o PDF agora. Tente novamente.')
     } finally {
       setBusy(false)
+      setProgress('')
     }
   }
   return (
@@ -1280,7 +1316,7 @@ function MonthlyReportButton({ month }) {
       disabled={busy}
       style={{ background: '#A28C99', color: '#fff', border: '1px solid #6D6A69', borderRadius: 8, padding: '8px 16px', fontWeight: 600 }}
     >
-      {busy ? 'Gerando…' : 'Resumo Mensal'}
+      {busy ? `Gerando…${progress ? ` ${progress}` : ''}` : 'Resumo Mensal'}
     </button>
   )
 }